@@ -0,0 +1,80 @@
+"""Time to import the modules that each command starts with, in a fresh interpreter
+every time, and whether that stays within budget:
+
+    uv run python -m benchmarks.imports
+    uv run python -m benchmarks.imports --repeat 10 --scale 2
+
+Exits with 1 if the median time of any module is over its budget, so it can run in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Seconds, on a laptop. The app is started by workers, the pipeline by every ingest
+# and get-temps run
+BUDGETS = {
+    "tempapp.main": 0.05,
+    "tempapp.pipeline": 0.5,
+    "tempapp.app": 1.0,
+}
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def import_time(module: str, env: dict) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", SNIPPET.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale", type=float, default=1, help="Multiply the budgets, for slow machines"
+    )
+    args = parser.parse_args()
+
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = Path(tmp) / "settings.json"
+        settings.write_text(
+            json.dumps({"data": str(Path(tmp) / "data"), "server": "", "headers": {}})
+        )
+        env = dict(os.environ, APP_SETTINGS=str(settings), XDG_CACHE_HOME=tmp)
+
+        for module, budget in BUDGETS.items():
+            # The first import fills the caches, like the first start after a deploy
+            import_time(module, env)
+            median = statistics.median(
+                import_time(module, env) for _ in range(args.repeat)
+            )
+            budget *= args.scale
+            status = "ok" if median <= budget else "OVER BUDGET"
+            print(
+                f"{module:<20} {median * 1000:8.1f} ms {budget * 1000:8.1f} ms {status}"
+            )
+            if median > budget:
+                over.append(module)
+
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Benchmarks of ingest and every render path of the dashboard on synthetic data.
+Results are written as JSON, so runs on different commits can be compared:
+
+    uv run python -m benchmarks.run --years 2 --every 15m --output before.json
+    uv run python -m benchmarks.run --years 2 --every 15m --baseline before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import timedelta
+from pathlib import Path
+
+
+def timed(fn: Callable, repeat: int, setup: Callable | None = None) -> dict:
+    """Run fn a number of times and return statistics of the time it took, in seconds"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace, tmp: Path) -> dict:
+    # The settings are read when tempapp is imported, so they have to be in place first
+    settings = tmp / "settings.json"
+    settings.write_text(
+        json.dumps(
+            {
+                "data": str(tmp / "data"),
+                "server": "localhost",
+                "headers": {},
+                "backend": args.backend,
+                "engine": args.engine,
+            }
+        )
+    )
+    os.environ["APP_SETTINGS"] = str(settings)
+
+    import polars as pl
+
+    from tempapp import charts, storage, utils
+
+    from .synthetic import generate
+
+    df = generate(args.years, args.sensors, args.every)
+    results: dict[str, dict] = {}
+
+    def bench(name: str, fn: Callable, setup: Callable | None = None) -> None:
+        results[name] = timed(fn, args.repeat, setup)
+        print(f"{name:<28} {results[name]['median'] * 1000:10.2f} ms", file=sys.stderr)
+
+    def clear_data_cache() -> None:
+        utils._data_cache.clear()
+
+    results["setup.write_history"] = timed(lambda: storage.write_rows(df), 1)
+
+    bench("load_data", utils.load_data, setup=clear_data_cache)
+    bench("load_recent", utils.load_recent, setup=clear_data_cache)
+
+    base = utils.load_recent()
+    max_timestamp = base.select("time_trunc").max().item()
+    max_day = base.select("day").max().item().date()
+
+    latest = base.filter(pl.col("time_trunc") == max_timestamp)["temp"]
+    bench("temp_boxes.colors", lambda: utils.colors_for(latest))
+
+    bench("line_plot.data", lambda: charts.line_plot_data(base, max_timestamp))
+    bench("line_plot.total", lambda: charts.line_plot(base, max_timestamp))
+
+    for days in (7, 30, 365):
+        bench(
+            f"heatmap.data.{days}d",
+            lambda days=days: charts.heatmap_grid(
+                max_day - timedelta(days=days - 1), max_day + timedelta(days=1), "Huset"
+            ),
+        )
+    bench("heatmap.total", lambda: charts.heatmap(max_day, "Huset"))
+
+    for days in (30, 365, int(365 * args.years)):
+        bench(
+            f"long_line_plot.data.{days}d",
+            lambda days=days: charts.long_line_plot_data(
+                max_day - timedelta(days=days), max_day
+            ),
+        )
+    bench(
+        "long_line_plot.total",
+        lambda: charts.long_line_plot(max_day - timedelta(days=30), max_day),
+    )
+
+    # One reading of every sensor, a bit later each time
+    sample = df.filter(pl.col("time") == pl.col("time").max())
+    step = iter(range(1, args.repeat + 1))
+    bench(
+        "ingest.write_rows",
+        lambda: storage.write_rows(
+            storage.with_derived_columns(
+                sample.with_columns(pl.col("time") + timedelta(minutes=next(step)))
+            )
+        ),
+    )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--sensors", type=int, default=3)
+    parser.add_argument("--every", default="1h", help="Sampling rate, like 1h or 15m")
+    parser.add_argument("--backend", default="parquet", choices=["parquet", "arrow"])
+    parser.add_argument("--engine", default="polars", choices=["polars", "duckdb"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier results to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args, Path(tmp))
+
+    import polars as pl
+
+    report = {
+        "commit": commit(),
+        "params": {
+            "years": args.years,
+            "sensors": args.sensors,
+            "every": args.every,
+            "backend": args.backend,
+            "engine": args.engine,
+            "repeat": args.repeat,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "polars": pl.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        for name, result in results.items():
+            if name in baseline:
+                # Above 1 means slower than the baseline
+                result["change"] = result["median"] / baseline[name]["median"]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Synthetic temperature data with the same schema as the data written by get_temps"""
+
+from datetime import datetime, timedelta
+from math import pi
+from zoneinfo import ZoneInfo
+
+import polars as pl
+from polars import DataFrame
+
+from tempapp import storage
+
+
+def floors(sensors: int) -> list[str]:
+    return [f"Våning {i}" for i in range(1, sensors + 1)]
+
+
+def generate(
+    years: float = 1,
+    sensors: int = 3,
+    every: str = "1h",
+    end: datetime | None = None,
+    seed: int = 0,
+) -> DataFrame:
+    """Readings of a number of sensors every so often over a number of years, following
+    a daily and a yearly cycle with a bit of noise on top"""
+    end = end or datetime.now(tz=ZoneInfo("Europe/Stockholm")).replace(
+        minute=0, second=0, microsecond=0
+    )
+    start = end - timedelta(days=365 * years)
+
+    times = pl.DataFrame(
+        {
+            "time": pl.datetime_range(
+                start,
+                end,
+                every,
+                time_unit="us",
+                time_zone="Europe/Stockholm",
+                eager=True,
+            )
+        }
+    )
+    sensor_floors = pl.DataFrame(
+        {"floor": floors(sensors), "offset": [i * 0.5 for i in range(sensors)]}
+    )
+
+    hours = pl.col("time").dt.hour() + pl.col("time").dt.minute() / 60
+    noise = (pl.struct("time", "floor").hash(seed) % 1000) / 1000 - 0.5
+
+    return storage.with_derived_columns(
+        times.join(sensor_floors, how="cross").with_columns(
+            temp=(
+                21
+                + pl.col("offset")
+                + 1.5 * ((hours - 15) / 24 * 2 * pi).cos()
+                + 2 * ((pl.col("time").dt.ordinal_day() - 200) / 365 * 2 * pi).cos()
+                + noise
+            ).round(1)
+        )
+    )
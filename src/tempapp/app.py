@@ -1,16 +1,20 @@
+import asyncio
+import json
 import logging
-from datetime import date, datetime, timedelta
-from typing import Any
+from collections.abc import Callable, Hashable
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
 
 import polars as pl
-import polars_xdt as xdt
 from dateutil.relativedelta import relativedelta
 from faicons import icon_svg as icon
-from pyecharts import options as opts
-from pyecharts.charts import HeatMap, Line
-from shiny import App, reactive, render, ui
+from shiny import App, reactive, render, req, ui
+from starlette.routing import Route
 
-from . import utils
+from . import assets, charts, metrics, storage, utils
+
+if TYPE_CHECKING:
+    from pyecharts.charts.chart import Chart
 
 # Tap into the uvicorn logging
 logger = logging.getLogger("uvicorn.error")
@@ -21,16 +25,24 @@ busy_indicators = (
     ui.busy_indicators.options(spinner_type="bars3", spinner_delay="0s"),
 )
 
-# Load theme attributes from brand.yml, but skip type checking because I'm lazy
-theme: Any = ui.Theme.from_brand(__file__)
+
+def chart_output(id: str) -> ui.Tag:
+    """Where a chart goes, rendered on the server or drawn by charts.js"""
+    if charts.RENDER_MODE == "client":
+        return ui.div(
+            id=id, class_="tempapp-chart", style="width: 100%; height: 500px;"
+        )
+    return ui.output_ui(id)
+
 
 app_ui = ui.page_navbar(
     ui.nav_panel(
         "Dashboard",
         ui.page_fluid(
-            ui.HTML(
-                '<script src="https://cdn.jsdelivr.net/npm/echarts@5.6.0/dist/echarts.js"></script>'
-            ),
+            ui.tags.script(src=assets.echarts_url()),
+            ui.tags.script(src=assets.url("charts.js"))
+            if charts.RENDER_MODE == "client"
+            else None,
             ui.row(ui.h3(icon("clock", style="regular"), " Just nu")),
             ui.br(),
             ui.row(
@@ -59,7 +71,7 @@ app_ui = ui.page_navbar(
             ui.br(),
             ui.row(
                 ui.card(
-                    ui.output_ui("line_plot"),
+                    chart_output("line_plot"),
                     style="background-color: #FFFFFF;",
                 ),
             ),
@@ -81,7 +93,7 @@ app_ui = ui.page_navbar(
                                 "Våning 3": "Våning 3",
                             },
                         ),
-                        ui.output_ui("heatmap"),
+                        chart_output("heatmap"),
                         style="background-color: #FFFFFF;",
                     ),
                 ),
@@ -109,7 +121,7 @@ app_ui = ui.page_navbar(
                         ui.input_action_button(
                             id="reset", label="Återställ", width="200px"
                         ),
-                        ui.output_ui("long_line_plot"),
+                        chart_output("long_line_plot"),
                         style="background-color: #FFFFFF;",
                     ),
                 )
@@ -119,31 +131,100 @@ app_ui = ui.page_navbar(
     ),
     id="main",
     title="TempApp",
-    theme=theme,
+    # The theme from brand.yml, compiled once
+    theme=assets.theme_css(),
     navbar_options=ui.navbar_options(
-        bg=theme.brand.color.primary,
+        # The primary color of the brand
+        class_="bg-primary",
         theme="dark",
     ),
 )
 
 
+# The version of the dataset, checked once every interval for the whole process and
+# shared by all sessions
+@reactive.poll(storage.version, utils.SETTINGS.get("poll_interval", 10))
+def dataset_version() -> int:
+    return storage.version()
+
+
+def chart_task(
+    name: str, prepare: Callable[[], Callable[[], Any]]
+) -> reactive.ExtendedTask:
+    """Render a chart in the render threads rather than on the event loop. prepare
+    reads the inputs of the chart and returns what to render with them. When they
+    change, the render of the inputs before is cancelled if it's still going"""
+
+    @reactive.extended_task
+    async def task(render: Callable[[], Any]) -> Any:
+        result = await charts.in_pool(
+            metrics.timed(metrics.render_seconds, output=name)(render)
+        )
+        if isinstance(result, str):
+            metrics.render_bytes.observe(len(result), output=name)
+        return result
+
+    @reactive.effect
+    def invoke():
+        render = prepare()
+        task.cancel()
+        task.invoke(render)
+
+    return task
+
+
 def server(input, output, session):
     logger.info("New session began at: " + datetime.now().strftime("%H:%M:%S"))
+    metrics.sessions.inc()
     logger.info("Loading data.")
 
-    base = utils.load_data()
+    # Set once the data is loaded, until then the outputs that read them wait. The
+    # data is shared between all sessions in the process, so never modify it in place
+    version = reactive.value()
+    base = reactive.value()
+    max_timestamp = reactive.value()
+    max_day = reactive.value()
 
-    max_timestamp: datetime = base.select("time_trunc").max().item()
-    max_day: date = base.select("day").max().item().date()
+    @reactive.effect
+    @reactive.event(dataset_version)
+    async def refresh():
+        """Load the data when the session starts, and again when new data has landed.
+        Outputs that only depend on the latest hour or day are left alone until those
+        change"""
+        new_version = dataset_version()
+        # In a thread, as it can mean reading the archive or exporting the hot copy of
+        # the whole dataset, which would hold up every other session
+        data = await asyncio.to_thread(utils.load_recent)
+        logger.info(f"Data loaded, version {new_version}")
+        first = not base.is_set()
+
+        version.set(new_version)
+        base.set(data)
+
+        timestamp = data.select("time_trunc").max().item()
+        if first or timestamp != max_timestamp():
+            max_timestamp.set(timestamp)
+        day = data.select("day").max().item().date()
+        if first or day != max_day():
+            max_day.set(day)
+
+        if first:
+            # Only when the session starts, new data shouldn't move a chosen range
+            ui.update_date_range(
+                id="daterange",
+                start=timestamp - relativedelta(months=1),
+                end=timestamp,
+            )
 
     @session.on_ended
     def end():
         logger.info("Session ended at: " + datetime.now().strftime("%H:%M:%S"))
+        metrics.sessions.dec()
 
     @output
     @render.text
     def status_right_now():
-        return f"""Kl {datetime.strftime(max_timestamp, "%H:%M (%-d/%-m)")}"""
+        return f"""Kl {datetime.strftime(max_timestamp(), "%H:%M (%-d/%-m)")}"""
 
     @reactive.effect
     @reactive.event(input.reset)
@@ -151,36 +232,27 @@ def server(input, output, session):
         """Reset the date range upon a button click and ensure the filter is up to date"""
         ui.update_date_range(
             id="daterange",
-            start=max_timestamp - relativedelta(months=1),
-            end=max_timestamp,
-        )
-
-    @reactive.effect
-    def _():
-        """Make sure that the date filter in long term data is properly up to date"""
-        ui.update_date_range(
-            id="daterange",
-            start=max_timestamp - relativedelta(months=1),
-            end=max_timestamp,
+            start=max_timestamp() - relativedelta(months=1),
+            end=max_timestamp(),
         )
 
     @output
     @render.ui
+    @metrics.rendered
     def temp_boxes():
-        data = base.filter(pl.col("time_trunc") == max_timestamp).select(
-            "floor", "temp"
+        # The latest reading of each floor, as there can be several within an hour
+        data = (
+            base()
+            .filter(pl.col("time_trunc") == max_timestamp())
+            .sort("time")
+            .group_by("floor")
+            .last()
+            .select("floor", "temp")
         )
 
-        # Split data for each floor
-        floors = utils.split_floor_data(data)
-
-        # Unpack the temps and round them
-        floor_temps = {
-            floor: df.with_columns(pl.col("temp").round(1).alias("temp"))
-            .select("temp")
-            .item()
-            for floor, df in floors.items()
-        }
+        # Round the temps and look up the colors of all floors at once
+        data = data.with_columns(pl.col("temp").round(1)).sort("floor")
+        colors = utils.colors_for(data["temp"])
 
         return ui.layout_column_wrap(
             *[
@@ -190,363 +262,147 @@ def server(input, output, session):
                     floor,
                     ui.h3(utils.dot_to_comma(temp)).add_style(f"color:{fg_color};"),
                 ).add_style(f"background-color:{bg_color};color:{fg_color};")
-                for floor, temp in floor_temps.items()
-                if (colors := utils.determine_colors(temp))
-                and (bg_color := colors[0])
-                and (fg_color := colors[1])
+                for floor, temp, bg_color, fg_color in data.hstack(colors).iter_rows()
             ],
             fixed_width=True,
         )
 
-    @render.ui
-    def line_plot() -> ui.HTML:
-        data = (
-            base.filter(
-                (pl.col("time_trunc") >= (max_timestamp - timedelta(hours=24)))
-                & (pl.col("time_trunc") <= max_timestamp)
-            )
-            .select("floor", "temp", "time_trunc", "date_iso", "hour")
-            .with_columns(
-                locale_hour_day=pl.when(
-                    pl.col("hour") == pl.col("time_trunc").min().dt.strftime("%H:%M")
-                )
-                .then(pl.col("time_trunc").dt.strftime("%H:%M - %-d/%-m"))
-                .otherwise(pl.col("hour"))
-            )
-        )
+    def line_plot_inputs() -> tuple:
+        return base(), max_timestamp()
 
-        house_avg_hour = (
-            data.select("locale_hour_day", "time_trunc", "temp")
-            .group_by("locale_hour_day", "time_trunc")
-            .agg(pl.col("temp").mean().round(1).alias("mean"))
-            .sort("time_trunc", "locale_hour_day")
-        )
+    def heatmap_inputs() -> tuple:
+        return max_day(), input.select_floor()
 
-        chart = (
-            Line(init_opts=opts.InitOpts(width="100%", renderer="svg"))
-            .add_xaxis(house_avg_hour["locale_hour_day"].to_list())
-            .add_yaxis(
-                "Husets medeltemperatur",
-                house_avg_hour["mean"].to_list(),
-                areastyle_opts=opts.AreaStyleOpts(color="lightgray", opacity=0.5),
-                linestyle_opts=opts.LineStyleOpts(color="lightgray", width=2),
-                symbol="none",
-                label_opts=opts.LabelOpts(is_show=False),
-                itemstyle_opts=opts.ItemStyleOpts(color="lightgray"),
-            )
-            .add_yaxis(
-                "Våning 1",
-                data.filter(pl.col("floor") == "Våning 1")["temp"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .add_yaxis(
-                "Våning 2",
-                data.filter(pl.col("floor") == "Våning 2")["temp"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .add_yaxis(
-                "Våning 3",
-                data.filter(pl.col("floor") == "Våning 3")["temp"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .set_series_opts(
-                label_opts=opts.LabelOpts(is_show=False),
-                markline_opts=opts.MarkLineOpts(
-                    data=[
-                        {"yAxis": 21, "lineStyle": {"color": "#0000FF"}},
-                        {"yAxis": 24, "lineStyle": {"color": "#FF0000"}},
-                    ],
-                    label_opts=opts.LabelOpts(is_show=False),
-                ),
+    def chart_width(id: str) -> float | None:
+        """The width of a chart in pixels, as reported by Shiny for outputs and by
+        charts.js for the charts that it draws"""
+        if charts.RENDER_MODE == "client":
+            return input[f"{id}_width"]() if f"{id}_width" in input else None
+        return session.clientdata.output_width(id)
+
+    # How many points the long line chart is drawn with, which only changes when its
+    # width changes enough to matter
+    long_line_plot_points = reactive.value(charts.POINTS)
+
+    @reactive.effect
+    def _():
+        long_line_plot_points.set(charts.point_budget(chart_width("long_line_plot")))
+
+    def long_line_plot_inputs() -> tuple:
+        req(input.daterange() and len(input.daterange()) == 2)
+        return *input.daterange(), long_line_plot_points()
+
+    if charts.RENDER_MODE == "client":
+        # The charts whose options have been sent to this session already
+        sent_options: set[str] = set()
+
+        def message(
+            name: str,
+            key: Hashable,
+            version: int,
+            payload: Callable[[], dict],
+            chart: Callable[[], "Chart"],
+        ) -> Callable[[], dict]:
+            """What to render for charts.js: the data of a chart and its options"""
+            return lambda: {
+                "id": name,
+                "data": charts.payloads.get(key, version, payload),
+                "options": charts.static_options(name, chart),
+            }
+
+        def send_chart(task: reactive.ExtendedTask) -> None:
+            """Send the data of a chart to charts.js once it's rendered, with its options
+            the first time"""
+
+            @reactive.effect
+            async def send():
+                message = dict(task.result())
+                if message["id"] in sent_options:
+                    del message["options"]
+                sent_options.add(message["id"])
+                metrics.render_bytes.observe(
+                    len(json.dumps(message)), output=message["id"]
+                )
+                await session.send_custom_message("tempapp-chart", message)
+
+        def line_plot_message() -> Callable[[], dict]:
+            data, timestamp = line_plot_inputs()
+            return message(
+                "line_plot",
+                "line_plot",
+                version(),
+                lambda: charts.line_plot_payload(data, timestamp),
+                lambda: charts.line_plot_chart(data, timestamp),
             )
-            .set_global_opts(
-                tooltip_opts=opts.TooltipOpts(
-                    is_show=True,
-                    trigger="axis",
-                    axis_pointer_type="shadow",
-                ),
-                legend_opts=opts.LegendOpts(
-                    orient="horizontal",
-                    pos_bottom="0",
-                    textstyle_opts=opts.TextStyleOpts(
-                        font_size=14,
-                        color="#313131",
-                        font_family="Arial",
-                    ),
-                ),
-                xaxis_opts=opts.AxisOpts(
-                    axislabel_opts=opts.LabelOpts(
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    )
-                ),
-                yaxis_opts=opts.AxisOpts(
-                    min_=18 if min(data["temp"]) > 18 else min(data["temp"]),
-                    max_=25 if max(data["temp"]) < 24 else max(data["temp"] + 1),
-                    axislabel_opts=opts.LabelOpts(
-                        formatter="{value} °C",
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    ),
-                    axisline_opts=opts.AxisLineOpts(
-                        is_show=True,
-                        linestyle_opts=opts.LineStyleOpts(
-                            color="#313131",
-                        ),
-                    ),
-                ),
+
+        def heatmap_message() -> Callable[[], dict]:
+            day, floor = heatmap_inputs()
+            return message(
+                "heatmap",
+                ("heatmap", day, floor),
+                version(),
+                lambda: charts.heatmap_payload(day, floor),
+                lambda: charts.heatmap_chart(day, floor),
             )
-        )
-        return ui.HTML(chart.render_embed())
 
-    @render.ui
-    def heatmap() -> ui.HTML:
-        data = base.filter(
-            (pl.col("day") >= max_day - timedelta(days=6))
-            & (pl.col("day") <= max_day + timedelta(days=1))
-        ).select("day", "hour", "temp", "floor")
-
-        if (selection := input.select_floor()) != "Huset":
-            data = data.filter(pl.col("floor") == selection)
-
-        avg_temp = (
-            data.group_by("day", "hour")
-            .agg(pl.col("temp").mean().round(1))
-            .sort("day", "hour")
-            .with_columns(
-                locale_day=xdt.format_localized(pl.col("day"), "%-d %B", "sv_SE"),
-                date_iso=pl.col("day").dt.strftime("%Y-%m-%d"),
+        def long_line_plot_message() -> Callable[[], dict]:
+            start, end, points = long_line_plot_inputs()
+            return message(
+                "long_line_plot",
+                ("long_line_plot", start, end, points),
+                version(),
+                lambda: charts.long_line_plot_payload(start, end, points),
+                lambda: charts.long_line_plot_chart(start, end),
             )
-        )
 
-        x_labels = (
-            avg_temp.select("locale_day", "date_iso")
-            .unique()
-            .sort(by="date_iso")
-            .select("locale_day")
-            .to_series()
-            .to_list()
-        )
-        y_labels = avg_temp["hour"].unique().sort(descending=True).to_list()
+        send_chart(chart_task("line_plot", line_plot_message))
+        send_chart(chart_task("heatmap", heatmap_message))
+        send_chart(chart_task("long_line_plot", long_line_plot_message))
+        return
 
-        full_grid = pl.DataFrame(
-            {
-                "locale_day": [x for x in x_labels for y in y_labels],
-                "hour": [y for x in x_labels for y in y_labels],
-            }
+    def line_plot_html() -> Callable[[], str]:
+        (data, timestamp), current = line_plot_inputs(), version()
+        return lambda: charts.rendered.get(
+            "line_plot", current, lambda: charts.line_plot(data, timestamp)
         )
 
-        merged = full_grid.join(
-            avg_temp.select(["locale_day", "hour", "temp"]),
-            on=["locale_day", "hour"],
-            how="left",
+    def heatmap_html() -> Callable[[], str]:
+        (day, floor), current = heatmap_inputs(), version()
+        return lambda: charts.rendered.get(
+            ("heatmap", day, floor), current, lambda: charts.heatmap(day, floor)
         )
 
-        x_idx = {label: idx for idx, label in enumerate(x_labels)}
-        y_idx = {label: idx for idx, label in enumerate(y_labels)}
-
-        value = [
-            [x_idx[row[0]], y_idx[row[1]], row[2]]
-            for row in merged.iter_rows(named=False)
-        ]
-
-        chart = (
-            HeatMap(init_opts=opts.InitOpts(width="100%", renderer="svg"))
-            .add_xaxis(x_labels)
-            .add_yaxis(
-                "Temperatur",
-                y_labels,
-                value,
-                label_opts=opts.LabelOpts(is_show=False),
-            )
-            .set_global_opts(
-                tooltip_opts=opts.TooltipOpts(
-                    is_show=True,
-                    trigger="item",
-                    axis_pointer_type="cross",
-                ),
-                xaxis_opts=opts.AxisOpts(
-                    axislabel_opts=opts.LabelOpts(
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    )
-                ),
-                yaxis_opts=opts.AxisOpts(
-                    axislabel_opts=opts.LabelOpts(
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    ),
-                    axisline_opts=opts.AxisLineOpts(
-                        is_show=True,
-                        linestyle_opts=opts.LineStyleOpts(
-                            color="#313131",
-                        ),
-                    ),
-                ),
-                legend_opts=opts.LegendOpts(is_show=False),
-                visualmap_opts=opts.VisualMapOpts(
-                    min_=18
-                    if min(avg_temp["temp"]) > 18
-                    else min(
-                        avg_temp["temp"]
-                    ),  # Set the minimum value for the color scale
-                    max_=25
-                    if max(avg_temp["temp"]) < 25
-                    else max(
-                        avg_temp["temp"]
-                    ),  # Set the maximum value for the color scale
-                    # ... other options
-                    range_color=utils.palette,
-                    is_show=False,
-                ),
-            )
+    def long_line_plot_html() -> Callable[[], str]:
+        (start, end, points), current = long_line_plot_inputs(), version()
+        return lambda: charts.rendered.get(
+            ("long_line_plot", start, end, points),
+            current,
+            lambda: charts.long_line_plot(start, end, points),
         )
-        return ui.HTML(chart.render_embed())
+
+    line_plot_task = chart_task("line_plot", line_plot_html)
+    heatmap_task = chart_task("heatmap", heatmap_html)
+    long_line_plot_task = chart_task("long_line_plot", long_line_plot_html)
 
     @render.ui
-    def long_line_plot() -> ui.HTML:
-        if not input.daterange() or len(input.daterange()) < 2:
-            raise ValueError("Invalid date range")
-
-        data = base.filter(
-            pl.col("time_trunc")
-            .dt.date()
-            .is_between(
-                (input.daterange()[0]),
-                input.daterange()[1] + timedelta(days=1),
-            )
-        ).select("day", "temp", "floor")
+    def line_plot() -> ui.HTML:
+        return ui.HTML(line_plot_task.result())
 
-        data_grouped = (
-            data.group_by(["day", "floor"])
-            .agg(
-                pl.col("temp").mean().round(1).alias("mean"),
-                pl.col("temp").std().fill_null(0).alias("std"),
-            )
-            .vstack(
-                data.group_by("day")
-                .agg(
-                    pl.col("temp").mean().round(1).alias("mean"),
-                    pl.col("temp").std().fill_null(0).alias("std"),
-                )
-                .with_columns(floor=pl.lit("Huset"))
-                .select("day", "floor", "mean", "std")
-            )
-            .with_columns(
-                (pl.col("mean") + pl.col("std")).round(1).alias("std_plus"),
-                (pl.col("mean") - pl.col("std")).round(1).alias("std_minus"),
-            )
-            .sort(["day", "floor"])
-            .with_columns(
-                locale_day=xdt.format_localized(pl.col("day"), "%-d %B %Y", "sv_SE")
-            )
-        )
+    @render.ui
+    def heatmap() -> ui.HTML:
+        return ui.HTML(heatmap_task.result())
 
-        chart = (
-            Line(init_opts=opts.InitOpts(width="100%", renderer="svg"))
-            .add_xaxis(
-                data_grouped.select("day", "locale_day")
-                .unique()
-                .sort("day")
-                .select("locale_day")
-                .to_series()
-                .to_list()
-            )
-            .add_yaxis(
-                "Husets medeltemperatur",
-                data_grouped.filter(pl.col("floor") == "Huset")["mean"].to_list(),
-                areastyle_opts=opts.AreaStyleOpts(color="lightgray", opacity=0.5),
-                linestyle_opts=opts.LineStyleOpts(color="lightgray", width=2),
-                symbol="none",
-                label_opts=opts.LabelOpts(is_show=False),
-                itemstyle_opts=opts.ItemStyleOpts(color="lightgray"),
-            )
-            .add_yaxis(
-                "Våning 1",
-                data_grouped.filter(pl.col("floor") == "Våning 1")["mean"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .add_yaxis(
-                "Våning 2",
-                data_grouped.filter(pl.col("floor") == "Våning 2")["mean"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .add_yaxis(
-                "Våning 3",
-                data_grouped.filter(pl.col("floor") == "Våning 3")["mean"].to_list(),
-                symbol_size=12,
-                symbol="circle",
-                linestyle_opts=opts.LineStyleOpts(width=2),
-            )
-            .set_series_opts(
-                label_opts=opts.LabelOpts(is_show=False),
-                markline_opts=opts.MarkLineOpts(
-                    data=[
-                        {"yAxis": 21, "lineStyle": {"color": "#0000FF"}},
-                        {"yAxis": 24, "lineStyle": {"color": "#FF0000"}},
-                    ],
-                    label_opts=opts.LabelOpts(is_show=False),
-                ),
-            )
-            .set_global_opts(
-                tooltip_opts=opts.TooltipOpts(
-                    is_show=True,
-                    trigger="axis",
-                    axis_pointer_type="shadow",
-                ),
-                legend_opts=opts.LegendOpts(
-                    orient="horizontal",
-                    pos_bottom="0",
-                    textstyle_opts=opts.TextStyleOpts(
-                        font_size=14,
-                        color="#313131",
-                        font_family="Arial",
-                    ),
-                ),
-                xaxis_opts=opts.AxisOpts(
-                    axislabel_opts=opts.LabelOpts(
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    )
-                ),
-                yaxis_opts=opts.AxisOpts(
-                    min_=18
-                    if min(data_grouped["mean"]) > 18
-                    else min(data_grouped["mean"]),
-                    max_=25
-                    if max(data_grouped["mean"]) < 24
-                    else max(data_grouped["mean"] + 1),
-                    axislabel_opts=opts.LabelOpts(
-                        formatter="{value} °C",
-                        font_size=14,
-                        font_family="Arial",
-                        color="#313131",
-                    ),
-                    axisline_opts=opts.AxisLineOpts(
-                        is_show=True,
-                        linestyle_opts=opts.LineStyleOpts(
-                            color="#313131",
-                        ),
-                    ),
-                ),
-            )
-        )
-        return ui.HTML(chart.render_embed())
+    @render.ui
+    def long_line_plot() -> ui.HTML:
+        return ui.HTML(long_line_plot_task.result())
 
 
 app = App(app_ui, server)
+
+# Prometheus metrics, next to the app itself
+app.starlette_app.router.routes.insert(0, Route("/metrics", metrics.endpoint))
+
+# Static files with long lived cache headers, as their names change with their content
+app.starlette_app.router.routes.insert(
+    0, Route(f"{assets.ROUTE}/{{name:path}}", assets.endpoint)
+)
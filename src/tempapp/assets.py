@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("uvicorn.error")
+
+# Files served by the app itself, under names with a hash of their content in them so
+# that browsers can keep them for good
+STATIC = Path(__file__).parent / "www"
+ROUTE = "/static"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+BRAND = Path(__file__).parent / "_brand.yml"
+
+ECHARTS = "vendor/echarts.min.js"
+ECHARTS_URL = "https://cdn.jsdelivr.net/npm/echarts@5.6.0/dist/echarts.min.js"
+
+# Compressed variants by their name in Accept-Encoding, the preferred one first
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# The name and content of each file by its fingerprinted name, and their variants
+_assets: dict[str, tuple[str, bytes]] = {}
+_variants: dict[tuple[str, str], bytes | None] = {}
+_lock = threading.Lock()
+
+
+def register(name: str, content: bytes) -> str:
+    """Serve content under its name with a hash of it added, and return the URL"""
+    stem, suffix = name.rsplit(".", 1)
+    fingerprinted = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}.{suffix}"
+    _assets[fingerprinted] = (name, content)
+    return f"{ROUTE}/{fingerprinted}"
+
+
+def url(name: str) -> str:
+    """The URL of a file in www"""
+    return register(name, (STATIC / name).read_bytes())
+
+
+def echarts_url() -> str:
+    """The vendored ECharts, or the CDN until `tempapp vendor` has been run"""
+    if not (STATIC / ECHARTS).exists():
+        logger.warning(f"{ECHARTS} is missing, run `tempapp vendor` to serve it")
+        return ECHARTS_URL
+    return url(ECHARTS)
+
+
+def cache_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "tempapp"
+
+
+def theme_css() -> Path:
+    """The theme from _brand.yml compiled to CSS, for `theme=` of the page. Compiling
+    the Sass takes a second or so, which is only paid once: the result is kept on disk
+    by a hash of _brand.yml and the version of Shiny, which brings the Bootstrap Sass"""
+    from shiny import __version__ as shiny_version
+
+    key = hashlib.sha256(BRAND.read_bytes() + shiny_version.encode()).hexdigest()
+    path = cache_dir() / f"theme-{key[:16]}.css"
+    if path.exists():
+        return path
+
+    from shiny import ui
+
+    css = ui.Theme.from_brand(BRAND).to_css().encode()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(css)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not cache the compiled theme at {path}: {e}")
+        # Shiny serves the theme from a file, so it has to be written somewhere
+        path = Path(tempfile.mkdtemp(prefix="tempapp-")) / path.name
+        path.write_bytes(css)
+    return path
+
+
+def compress(content: bytes, encoding: str) -> bytes | None:
+    if encoding == "gzip":
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(content, quality=11)
+    return None
+
+
+def variant(fingerprinted: str, encoding: str) -> bytes | None:
+    """A compressed variant of a file. Read from next to the file if it was compressed
+    ahead of time, otherwise compressed once and kept"""
+    key = (fingerprinted, encoding)
+    with _lock:
+        if key not in _variants:
+            name, content = _assets[fingerprinted]
+            source = STATIC / name
+            path = source.with_name(source.name + SUFFIXES[encoding])
+            if path.exists() and path.stat().st_mtime >= source.stat().st_mtime:
+                _variants[key] = path.read_bytes()
+            else:
+                _variants[key] = compress(content, encoding)
+        return _variants[key]
+
+
+def precompress(path: Path) -> None:
+    """Write the compressed variants of a file next to it"""
+    content = path.read_bytes()
+    for encoding, suffix in SUFFIXES.items():
+        if (compressed := compress(content, encoding)) is not None:
+            path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+def vendor() -> None:
+    """Download the ECharts build that the app serves, and compress it ahead of time"""
+    import requests
+
+    path = STATIC / ECHARTS
+    path.parent.mkdir(exist_ok=True)
+
+    response = requests.get(ECHARTS_URL, timeout=60)
+    response.raise_for_status()
+    path.write_bytes(response.content)
+    precompress(path)
+    print(f"Vendored {ECHARTS_URL} to {path}")
+
+
+def endpoint(request: Request) -> Response:
+    """Serve a file by its fingerprinted name, compressed if the browser accepts it.
+    Not async, so Starlette runs it in a thread while compressing"""
+    fingerprinted = request.path_params["name"]
+    if fingerprinted not in _assets:
+        return Response(status_code=404)
+
+    name, content = _assets[fingerprinted]
+    headers = {"Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+    accepted = {
+        part.split(";")[0].strip()
+        for part in request.headers.get("accept-encoding", "").split(",")
+    }
+    for encoding in SUFFIXES:
+        if encoding in accepted and (body := variant(fingerprinted, encoding)):
+            content = body
+            headers["Content-Encoding"] = encoding
+            break
+
+    return Response(
+        content,
+        media_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        headers=headers,
+    )
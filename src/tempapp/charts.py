@@ -0,0 +1,719 @@
+import asyncio
+import json
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, TypeVar
+from zoneinfo import ZoneInfo
+
+import polars as pl
+import polars_xdt as xdt
+from polars import DataFrame
+
+from . import storage, utils
+
+# pyecharts is only imported once the first chart is made, it's slow to import
+if TYPE_CHECKING:
+    from pyecharts.charts import HeatMap, Line
+    from pyecharts.charts.chart import Chart
+
+T = TypeVar("T")
+
+
+class RenderCache:
+    """Rendered charts shared by all sessions, dropping the least recently used ones
+    when all charts take up more than max_bytes, as measured by size. A chart that is
+    asked for while it's being rendered is waited for rather than rendered again"""
+
+    def __init__(self, max_bytes: int, size: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizeof = size
+        self._charts: OrderedDict[Hashable, Any] = OrderedDict()
+        self._version: int | None = None
+        self._rendering: dict[tuple[int, Hashable], Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int, render: Callable[[], T]) -> T:
+        """The cached chart for a key and dataset version, rendering it if needed"""
+        with self._lock:
+            if self._version is None or version > self._version:
+                # New data has landed, so none of the charts are up to date anymore
+                self._charts.clear()
+                self.size = 0
+                self._version = version
+            elif version == self._version and key in self._charts:
+                self._charts.move_to_end(key)
+                return self._charts[key]
+
+            if (version, key) in self._rendering:
+                rendering = self._rendering[(version, key)]
+                first = False
+            else:
+                rendering = self._rendering[(version, key)] = Future()
+                first = True
+
+        if not first:
+            return rendering.result()
+
+        try:
+            chart = render()
+        except BaseException as e:
+            with self._lock:
+                del self._rendering[(version, key)]
+            rendering.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._rendering[(version, key)]
+            if version == self._version and key not in self._charts:
+                self._charts[key] = chart
+                self.size += self._sizeof(chart)
+                while self.size > self.max_bytes and len(self._charts) > 1:
+                    _, dropped = self._charts.popitem(last=False)
+                    self.size -= self._sizeof(dropped)
+        rendering.set_result(chart)
+
+        return chart
+
+
+# "html" renders every chart on the server and sends it as HTML with all options
+# inlined, "client" sends the options of a chart once and then only its data, which
+# charts.js draws in the browser
+RENDER_MODE = utils.SETTINGS.get("render_mode", "html")
+
+rendered = RenderCache(max_bytes=utils.SETTINGS.get("chart_cache_mb", 32) * 2**20)
+payloads = RenderCache(
+    max_bytes=utils.SETTINGS.get("chart_cache_mb", 32) * 2**20,
+    size=lambda payload: len(json.dumps(payload)),
+)
+
+# Widths of the buckets that the long line chart is downsampled to, in hours. The
+# narrowest that keeps the chart within its budget of points is used, so the resolution
+# gets finer as the range of dates gets shorter
+RESOLUTIONS = (1, 2, 3, 6, 12, 24, 48, 168, 336, 720)
+
+# Points of the long line chart when the width of the chart isn't known
+POINTS = 256
+
+# The series of the line charts, the whole house first
+FLOORS = ("Huset", "Våning 1", "Våning 2", "Våning 3")
+
+# Threads that charts are rendered in, shared by all sessions, so that a slow chart
+# doesn't hold up the event loop that serves every other session. Polars lets go of
+# the GIL while it works, so the data of several charts is prepared at once
+pool = ThreadPoolExecutor(
+    max_workers=utils.SETTINGS.get("render_threads", 4), thread_name_prefix="render"
+)
+
+# The options of each chart without its data, made from the first one rendered
+_static_options: dict[str, dict] = {}
+
+# Swedish labels of every day in the range that has been asked for so far, and of
+# every hour of the day
+_day_labels = pl.DataFrame(
+    schema={"date": pl.Date, "locale_day": pl.String, "locale_day_year": pl.String}
+)
+_day_labels_lock = threading.Lock()
+HOUR_LABELS = pl.DataFrame(
+    {"hour_of_day": range(24), "hour": [f"{hour:02d}:00" for hour in range(24)]},
+    schema={"hour_of_day": pl.Int8, "hour": pl.String},
+)
+
+
+async def in_pool(render: Callable[[], T]) -> T:
+    """Render in the render threads. If the awaiting task is cancelled before a thread
+    has picked it up, it never runs, but once it has started it's run to the end"""
+    return await asyncio.get_running_loop().run_in_executor(pool, render)
+
+
+def y_range(temps: pl.Series) -> tuple[float, float]:
+    """The y axis of a line chart spans 18 to 25 °C, or more if the temps do"""
+    return (
+        18 if min(temps) > 18 else min(temps),
+        25 if max(temps) < 24 else max(temps + 1),
+    )
+
+
+def color_range(temps: pl.Series) -> tuple[float, float]:
+    """The color scale of a heatmap spans 18 to 25 °C, or more if the temps do"""
+    return (
+        18 if temps.min() > 18 else temps.min(),
+        25 if temps.max() < 25 else temps.max(),
+    )
+
+
+def day_labels(start: date, end: date) -> DataFrame:
+    """Swedish labels of the days from start to end, like "1 mars" and "1 mars 2025".
+    They come from a table of days that is only made again, to cover more days, when
+    asked for days outside of it, so labels aren't formatted on every render"""
+    global _day_labels
+
+    with _day_labels_lock:
+        covered = _day_labels["date"]
+        if covered.is_empty() or start < covered[0] or end > covered[-1]:
+            first = start if covered.is_empty() else min(start, covered[0])
+            last = end if covered.is_empty() else max(end, covered[-1])
+            _day_labels = pl.DataFrame(
+                {"date": pl.date_range(first, last, "1d", eager=True)}
+            ).with_columns(
+                locale_day=xdt.format_localized(pl.col("date"), "%-d %B", "sv_SE"),
+                locale_day_year=xdt.format_localized(
+                    pl.col("date"), "%-d %B %Y", "sv_SE"
+                ),
+            )
+        labels = _day_labels
+
+    return labels.filter(pl.col("date").is_between(start, end))
+
+
+def line_plot_data(
+    base: DataFrame, max_timestamp: datetime
+) -> tuple[DataFrame, DataFrame]:
+    """Hourly means of each floor over the last 24 hours, and of the house. Readings
+    can come in every minute, but the x axis has one label per hour"""
+    readings = base.filter(
+        (pl.col("time_trunc") >= (max_timestamp - timedelta(hours=24)))
+        & (pl.col("time_trunc") <= max_timestamp)
+    )
+
+    house_avg_hour = (
+        readings.group_by("time_trunc", "hour")
+        .agg(pl.col("temp").mean().round(1).alias("mean"))
+        .sort("time_trunc")
+        .with_columns(
+            # The first hour, and the same hour a day later, with their dates
+            locale_hour_day=pl.when(
+                pl.col("time_trunc").dt.hour() == pl.col("time_trunc").min().dt.hour()
+            )
+            .then(
+                pl.format(
+                    "{} - {}/{}",
+                    "hour",
+                    pl.col("time_trunc").dt.day(),
+                    pl.col("time_trunc").dt.month(),
+                )
+            )
+            .otherwise(pl.col("hour"))
+        )
+        .select("locale_hour_day", "time_trunc", "mean")
+    )
+
+    data = (
+        readings.group_by("floor", "time_trunc")
+        .agg(pl.col("temp").mean().round(1))
+        .sort("time_trunc", "floor")
+    )
+
+    return data, house_avg_hour
+
+
+def line_plot_floor(
+    data: DataFrame, house_avg_hour: DataFrame, floor: str
+) -> pl.Series:
+    """The hourly means of a floor at each hour on the x axis, missing where the floor
+    has no readings in that hour"""
+    hours = house_avg_hour.select("time_trunc")
+    floor_temps = data.filter(pl.col("floor") == floor)
+    return hours.join(
+        floor_temps, on="time_trunc", how="left", maintain_order="left"
+    ).get_column("temp")
+
+
+def line_plot_chart(base: DataFrame, max_timestamp: datetime) -> "Line":
+    """Line chart of the last 24 hours, for each floor and the house on average"""
+    from pyecharts import options as opts
+    from pyecharts.charts import Line
+
+    data, house_avg_hour = line_plot_data(base, max_timestamp)
+    y_min, y_max = y_range(data["temp"])
+
+    chart = (
+        Line(init_opts=opts.InitOpts(width="100%", renderer="svg"))
+        .add_xaxis(house_avg_hour["locale_hour_day"].to_list())
+        .add_yaxis(
+            "Husets medeltemperatur",
+            house_avg_hour["mean"].to_list(),
+            areastyle_opts=opts.AreaStyleOpts(color="lightgray", opacity=0.5),
+            linestyle_opts=opts.LineStyleOpts(color="lightgray", width=2),
+            symbol="none",
+            label_opts=opts.LabelOpts(is_show=False),
+            itemstyle_opts=opts.ItemStyleOpts(color="lightgray"),
+        )
+        .add_yaxis(
+            "Våning 1",
+            line_plot_floor(data, house_avg_hour, "Våning 1").to_list(),
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .add_yaxis(
+            "Våning 2",
+            line_plot_floor(data, house_avg_hour, "Våning 2").to_list(),
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .add_yaxis(
+            "Våning 3",
+            line_plot_floor(data, house_avg_hour, "Våning 3").to_list(),
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .set_series_opts(
+            label_opts=opts.LabelOpts(is_show=False),
+            markline_opts=opts.MarkLineOpts(
+                data=[
+                    {"yAxis": 21, "lineStyle": {"color": "#0000FF"}},
+                    {"yAxis": 24, "lineStyle": {"color": "#FF0000"}},
+                ],
+                label_opts=opts.LabelOpts(is_show=False),
+            ),
+        )
+        .set_global_opts(
+            tooltip_opts=opts.TooltipOpts(
+                is_show=True,
+                trigger="axis",
+                axis_pointer_type="shadow",
+            ),
+            legend_opts=opts.LegendOpts(
+                orient="horizontal",
+                pos_bottom="0",
+                textstyle_opts=opts.TextStyleOpts(
+                    font_size=14,
+                    color="#313131",
+                    font_family="Arial",
+                ),
+            ),
+            xaxis_opts=opts.AxisOpts(
+                axislabel_opts=opts.LabelOpts(
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                )
+            ),
+            yaxis_opts=opts.AxisOpts(
+                min_=y_min,
+                max_=y_max,
+                axislabel_opts=opts.LabelOpts(
+                    formatter="{value} °C",
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                ),
+                axisline_opts=opts.AxisLineOpts(
+                    is_show=True,
+                    linestyle_opts=opts.LineStyleOpts(
+                        color="#313131",
+                    ),
+                ),
+            ),
+        )
+    )
+    return chart
+
+
+def heatmap_grid(
+    start: date, end: date, floor: str
+) -> tuple[list[str], list[str], DataFrame]:
+    """Hourly mean temps between two dates as a dense day by hour grid. Returns the
+    labels of the days and hours, and the temp of every cell by their indexes. Days
+    past the retention of the hourly rollup only have a daily mean, so they're left
+    out rather than drawn as a single hour"""
+    avg_temp = (
+        storage.rollup("hourly", start, end)
+        .filter(pl.col("floor") == floor, pl.col("tier") == "hourly")
+        .select(
+            date=pl.col("time").dt.date(),
+            hour_of_day=pl.col("time").dt.hour(),
+            temp=pl.col("mean").round(1),
+        )
+    )
+
+    days = (
+        avg_temp.select("date")
+        .unique()
+        .sort("date")
+        .with_row_index("x")
+        .join(day_labels(start, end), on="date", how="left")
+        .sort("x")
+    )
+    hours = (
+        avg_temp.select("hour_of_day")
+        .unique()
+        .sort("hour_of_day", descending=True)
+        .with_row_index("y")
+        .join(HOUR_LABELS, on="hour_of_day", how="left")
+        .sort("y")
+    )
+
+    # Every day and hour, whether there's a temp for it or not
+    cells = (
+        days.select("x", "date")
+        .join(hours.select("y", "hour_of_day"), how="cross")
+        .join(avg_temp, on=["date", "hour_of_day"], how="left")
+        .select("x", "y", "temp")
+        .sort("x", "y")
+    )
+
+    return days["locale_day"].to_list(), hours["hour"].to_list(), cells
+
+
+def heatmap_chart(max_day: date, floor: str) -> "HeatMap":
+    """Heatmap of the hourly mean temps of the last 7 days"""
+    from pyecharts import options as opts
+    from pyecharts.charts import HeatMap
+
+    x_labels, y_labels, cells = heatmap_grid(
+        max_day - timedelta(days=6), max_day + timedelta(days=1), floor
+    )
+    value = cells.rows()
+    color_min, color_max = color_range(cells["temp"])
+
+    chart = (
+        HeatMap(init_opts=opts.InitOpts(width="100%", renderer="svg"))
+        .add_xaxis(x_labels)
+        .add_yaxis(
+            "Temperatur",
+            y_labels,
+            value,
+            label_opts=opts.LabelOpts(is_show=False),
+        )
+        .set_global_opts(
+            tooltip_opts=opts.TooltipOpts(
+                is_show=True,
+                trigger="item",
+                axis_pointer_type="cross",
+            ),
+            xaxis_opts=opts.AxisOpts(
+                axislabel_opts=opts.LabelOpts(
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                )
+            ),
+            yaxis_opts=opts.AxisOpts(
+                axislabel_opts=opts.LabelOpts(
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                ),
+                axisline_opts=opts.AxisLineOpts(
+                    is_show=True,
+                    linestyle_opts=opts.LineStyleOpts(
+                        color="#313131",
+                    ),
+                ),
+            ),
+            legend_opts=opts.LegendOpts(is_show=False),
+            visualmap_opts=opts.VisualMapOpts(
+                min_=color_min,  # Set the minimum value for the color scale
+                max_=color_max,  # Set the maximum value for the color scale
+                # ... other options
+                range_color=utils.palette,
+                is_show=False,
+            ),
+        )
+    )
+    return chart
+
+
+def point_budget(width: float | None) -> int:
+    """About one point per 4 pixels of the width of a chart, rounded to a power of two
+    so that charts of about the same width share their renders"""
+    if not width:
+        # Like on a tab that isn't shown
+        return POINTS
+    return 2 ** min(max(round(math.log2(width / 4)), 5), 10)
+
+
+def show_symbols(data: DataFrame, points: int) -> bool:
+    """Whether the points of the long line chart are far enough apart, about 16 pixels,
+    to be drawn as circles, rather than just as the line through them"""
+    return data.height * 4 <= points
+
+
+def resolution(start: date, end: date, points: int) -> int:
+    """The width of the buckets, in hours, of the long line chart between two dates"""
+    # Up to the end of the day after, with the hour that comes twice in October
+    hours = ((end - start).days + 2) * 24 + 1
+    for every in RESOLUTIONS:
+        # Hours are drawn as they are, wider buckets as their min and max
+        if math.ceil(hours / every) * (1 if every == 1 else 2) <= points:
+            return every
+    return math.ceil(hours * 2 / points) + 1
+
+
+def long_line_plot_data(start: date, end: date, points: int = POINTS) -> DataFrame:
+    """Hourly mean temps between two dates, with a column for each floor and a row for
+    each point of the chart. When there are more hours than points, the hours are put
+    in buckets, and each bucket is drawn as its lowest and highest hour in the order
+    they came in, so the peaks of the line are kept. Days that only have a daily mean
+    left are a single point, labeled with the day alone"""
+    every = resolution(start, end, points)
+    first = datetime(
+        start.year, start.month, start.day, tzinfo=ZoneInfo("Europe/Stockholm")
+    )
+
+    hours = (
+        storage.rollup("hourly", start, end + timedelta(days=1))
+        .sort("time")
+        .with_columns(
+            bucket=((pl.col("time") - first).dt.total_hours() // every).cast(pl.Int64)
+        )
+        # Both points of a bucket are labeled with its first hour
+        .with_columns(
+            start=pl.col("time").min().over("bucket"),
+            daily=(pl.col("tier") == "daily").all().over("bucket"),
+            single=pl.col("time").n_unique().over("bucket") == 1,
+        )
+    )
+
+    if every == 1:
+        points_df = hours.select("floor", "start", "daily", "mean", slot="bucket")
+    else:
+        envelopes = hours.group_by("bucket", "start", "daily", "single", "floor").agg(
+            low=pl.col("mean").min(),
+            high=pl.col("mean").max(),
+            low_first=pl.col("mean").arg_min() <= pl.col("mean").arg_max(),
+        )
+        points_df = pl.concat(
+            envelopes.filter(pl.lit(i == 0) | ~pl.col("single")).select(
+                "floor",
+                "start",
+                "daily",
+                slot=pl.col("bucket") * 2 + i,
+                mean=pl.when(pl.col("low_first") == (i == 0))
+                .then("low")
+                .otherwise("high"),
+            )
+            for i in (0, 1)
+        )
+
+    data = (
+        points_df.select("slot", "start", "daily", "floor", pl.col("mean").round(1))
+        .pivot(on="floor", index=["slot", "start", "daily"], values="mean")
+        .with_columns(
+            pl.lit(None, pl.Float64).alias(floor)
+            for floor in FLOORS
+            if floor not in points_df["floor"]
+        )
+        .with_columns(
+            date=pl.col("start").dt.date(), hour_of_day=pl.col("start").dt.hour()
+        )
+        .join(day_labels(start, end + timedelta(days=1)), on="date", how="left")
+        .join(HOUR_LABELS, on="hour_of_day", how="left")
+    )
+
+    # The hour is only of interest when there's more than one point a day
+    label = (
+        pl.when(pl.col("daily"))
+        .then(pl.col("locale_day_year"))
+        .otherwise(pl.format("{} {}", "locale_day_year", "hour"))
+        if every < 24
+        else pl.col("locale_day_year")
+    )
+    return data.select("slot", "start", label.alias("label"), *FLOORS).sort("slot")
+
+
+def long_line_plot_temps(data: DataFrame) -> pl.Series:
+    """All temps of the long line chart, for the range of its y axis"""
+    return pl.concat([data[floor] for floor in FLOORS]).drop_nulls()
+
+
+def long_line_plot_chart(start: date, end: date, points: int = POINTS) -> "Line":
+    """Line chart of the mean temps between two dates, in at most about points points"""
+    from pyecharts import options as opts
+    from pyecharts.charts import Line
+
+    data = long_line_plot_data(start, end, points)
+    y_min, y_max = y_range(long_line_plot_temps(data))
+    symbols = show_symbols(data, points)
+
+    chart = (
+        Line(init_opts=opts.InitOpts(width="100%", renderer="svg"))
+        .add_xaxis(data["label"].to_list())
+        .add_yaxis(
+            "Husets medeltemperatur",
+            data["Huset"].to_list(),
+            areastyle_opts=opts.AreaStyleOpts(color="lightgray", opacity=0.5),
+            linestyle_opts=opts.LineStyleOpts(color="lightgray", width=2),
+            symbol="none",
+            label_opts=opts.LabelOpts(is_show=False),
+            itemstyle_opts=opts.ItemStyleOpts(color="lightgray"),
+        )
+        .add_yaxis(
+            "Våning 1",
+            data["Våning 1"].to_list(),
+            is_symbol_show=symbols,
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .add_yaxis(
+            "Våning 2",
+            data["Våning 2"].to_list(),
+            is_symbol_show=symbols,
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .add_yaxis(
+            "Våning 3",
+            data["Våning 3"].to_list(),
+            is_symbol_show=symbols,
+            symbol_size=12,
+            symbol="circle",
+            linestyle_opts=opts.LineStyleOpts(width=2),
+        )
+        .set_series_opts(
+            label_opts=opts.LabelOpts(is_show=False),
+            markline_opts=opts.MarkLineOpts(
+                data=[
+                    {"yAxis": 21, "lineStyle": {"color": "#0000FF"}},
+                    {"yAxis": 24, "lineStyle": {"color": "#FF0000"}},
+                ],
+                label_opts=opts.LabelOpts(is_show=False),
+            ),
+        )
+        .set_global_opts(
+            tooltip_opts=opts.TooltipOpts(
+                is_show=True,
+                trigger="axis",
+                axis_pointer_type="shadow",
+            ),
+            legend_opts=opts.LegendOpts(
+                orient="horizontal",
+                pos_bottom="0",
+                textstyle_opts=opts.TextStyleOpts(
+                    font_size=14,
+                    color="#313131",
+                    font_family="Arial",
+                ),
+            ),
+            xaxis_opts=opts.AxisOpts(
+                axislabel_opts=opts.LabelOpts(
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                )
+            ),
+            yaxis_opts=opts.AxisOpts(
+                min_=y_min,
+                max_=y_max,
+                axislabel_opts=opts.LabelOpts(
+                    formatter="{value} °C",
+                    font_size=14,
+                    font_family="Arial",
+                    color="#313131",
+                ),
+                axisline_opts=opts.AxisLineOpts(
+                    is_show=True,
+                    linestyle_opts=opts.LineStyleOpts(
+                        color="#313131",
+                    ),
+                ),
+            ),
+        )
+    )
+    return chart
+
+
+def embed(chart: "Chart") -> str:
+    """The HTML of a chart, without the script tag that would load ECharts from the
+    pyecharts CDN once again, as the page has it already"""
+    chart.js_dependencies.items.clear()
+    return chart.render_embed()
+
+
+def line_plot(base: DataFrame, max_timestamp: datetime) -> str:
+    return embed(line_plot_chart(base, max_timestamp))
+
+
+def heatmap(max_day: date, floor: str) -> str:
+    return embed(heatmap_chart(max_day, floor))
+
+
+def long_line_plot(start: date, end: date, points: int = POINTS) -> str:
+    return embed(long_line_plot_chart(start, end, points))
+
+
+def encode(temps: pl.Series) -> list[int | None]:
+    """Temps in tenths of a degree, each as the difference to the one before it, which
+    keeps the JSON short since temps rarely change much from one reading to the next.
+    Missing temps stay missing, see decode in charts.js"""
+    tenths = (temps * 10).round().cast(pl.Int32)
+    before = tenths.forward_fill().fill_null(0).shift(1, fill_value=0)
+    return (tenths - before).to_list()
+
+
+def static_options(name: str, chart: Callable[[], "Chart"]) -> dict:
+    """The options of a chart that stay the same between updates, that is everything
+    but its data and the range of its axes. Only made once per kind of chart"""
+    if name not in _static_options:
+        options = json.loads(chart().dump_options())
+        for axis in (*options["xAxis"], *options["yAxis"]):
+            for key in ("data", "min", "max"):
+                axis.pop(key, None)
+        for series in options["series"]:
+            series["data"] = []
+        if "visualMap" in options:
+            options["visualMap"].pop("min", None)
+            options["visualMap"].pop("max", None)
+        _static_options[name] = options
+    return _static_options[name]
+
+
+def line_plot_payload(base: DataFrame, max_timestamp: datetime) -> dict:
+    """The data of the line chart of the last 24 hours, for charts.js"""
+    data, house_avg_hour = line_plot_data(base, max_timestamp)
+    x = house_avg_hour["locale_hour_day"].to_list()
+    y_min, y_max = y_range(data["temp"])
+
+    series = [house_avg_hour["mean"]] + [
+        line_plot_floor(data, house_avg_hour, floor)
+        for floor in ("Våning 1", "Våning 2", "Våning 3")
+    ]
+    return {
+        "kind": "line",
+        "x": x,
+        "series": [encode(temps) for temps in series],
+        "min": y_min,
+        "max": y_max,
+    }
+
+
+def heatmap_payload(max_day: date, floor: str) -> dict:
+    """The data of the heatmap of the last 7 days, for charts.js. The cells are in
+    order of day and then hour, so only their temps have to be sent"""
+    x_labels, y_labels, cells = heatmap_grid(
+        max_day - timedelta(days=6), max_day + timedelta(days=1), floor
+    )
+    color_min, color_max = color_range(cells["temp"])
+    return {
+        "kind": "heatmap",
+        "x": x_labels,
+        "y": y_labels,
+        "temps": encode(cells["temp"]),
+        "min": color_min,
+        "max": color_max,
+    }
+
+
+def long_line_plot_payload(start: date, end: date, points: int = POINTS) -> dict:
+    """The data of the line chart of mean temps between two dates, for charts.js"""
+    data = long_line_plot_data(start, end, points)
+    y_min, y_max = y_range(long_line_plot_temps(data))
+
+    return {
+        "kind": "line",
+        "x": data["label"].to_list(),
+        "series": [encode(data[floor]) for floor in FLOORS],
+        "symbols": show_symbols(data, points),
+        "min": y_min,
+        "max": y_max,
+    }
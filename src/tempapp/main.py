@@ -1,20 +1,72 @@
+import logging
 import sys
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
-import uvicorn
 
-from .pipeline import get_temps
+def option(args: list[str], name: str, default: float) -> float:
+    """Get the value given after a flag like --interval, or the default"""
+    if name not in args:
+        return default
+    try:
+        return float(args[args.index(name) + 1])
+    except (IndexError, ValueError):
+        print(f"{name} needs a number")
+        sys.exit(1)
+
+
+def text_option(args: list[str], name: str, default: str) -> str:
+    """Get the word given after a flag like --compression, or the default"""
+    if name not in args:
+        return default
+    try:
+        return args[args.index(name) + 1]
+    except IndexError:
+        print(f"{name} needs a value")
+        sys.exit(1)
+
+
+def time_option(args: list[str], name: str, default: datetime | None) -> datetime:
+    """Get the date or time given after a flag like --from, in Swedish time unless it
+    says otherwise, or the default"""
+    if name not in args and default is not None:
+        return default
+    try:
+        value = datetime.fromisoformat(args[args.index(name) + 1])
+    except (IndexError, ValueError):
+        print(f"{name} needs a date like 2025-01-31 or a time like 2025-01-31T12:00")
+        sys.exit(1)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo("Europe/Stockholm"))
+    return value
 
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: tempapp [run | get-temps | version]")
+        print(
+            "Usage: tempapp [run [--workers N] | get-temps | ingest [--interval N]"
+            " [--batch-size N] [--flush-interval N] | backfill --from DATE [--to DATE]"
+            " [--page-days N] [--batch-size N] | partition | migrate | compact"
+            " [--compression NAME] [--level N] [--row-group-size N] | retain | rollup"
+            " | vendor | version]"
+        )
         sys.exit(1)
 
     command, *args = sys.argv[1:]
     dev = "dev" if "dev" in args else None
 
     command = sys.argv[1]
-    if command == "run":
+    workers = int(option(args, "--workers", 1))
+    if command == "run" and workers > 1 and not dev:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+        )
+        from . import serve
+
+        serve.run(workers, host="0.0.0.0", port=8000)
+    elif command == "run":
+        import uvicorn
+
         uvicorn.run(
             "tempapp.app:app",
             host="0.0.0.0",
@@ -23,7 +75,63 @@ def main():
             reload_dirs=["src/tempapp"] if dev else None,
         )
     elif command == "get-temps":
+        from .pipeline import get_temps
+
         get_temps()
+    elif command == "ingest":
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+        )
+        from .pipeline import ingest
+
+        ingest(
+            interval=option(args, "--interval", 60),
+            batch_size=int(option(args, "--batch-size", 100)),
+            flush_interval=option(args, "--flush-interval", 300),
+        )
+    elif command == "backfill":
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+        )
+        from .pipeline import backfill
+
+        backfill(
+            start=time_option(args, "--from", None),
+            end=time_option(args, "--to", datetime.now(ZoneInfo("Europe/Stockholm"))),
+            page=timedelta(days=option(args, "--page-days", 1)),
+            batch_size=int(option(args, "--batch-size", 100_000)),
+        )
+    elif command == "partition":
+        from . import storage
+
+        storage.partition()
+    elif command == "migrate":
+        from . import storage
+
+        storage.migrate()
+    elif command == "compact":
+        from . import storage
+
+        storage.compact_files(
+            compression=text_option(args, "--compression", storage.COMPRESSION),
+            level=int(option(args, "--level", storage.COMPRESSION_LEVEL)),
+            row_group_size=int(
+                option(args, "--row-group-size", storage.ROW_GROUP_SIZE)
+            ),
+        )
+    elif command == "retain":
+        from . import storage
+
+        storage.retain()
+    elif command == "rollup":
+        from . import storage
+
+        with storage.writing():
+            storage.rebuild_rollups()
+    elif command == "vendor":
+        from . import assets
+
+        assets.vendor()
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
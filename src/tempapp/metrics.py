@@ -0,0 +1,181 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import UserString
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from starlette.requests import Request
+    from starlette.responses import PlainTextResponse
+
+# Upper bounds of the buckets of each kind of histogram
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+
+class Metric:
+    """Values of a metric by their labels, in the Prometheus text format. Recording a
+    value is a dict lookup and an addition, formatting only happens when scraped"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterator[tuple[str, tuple, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+    def format(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            label_text = ",".join(f'{label}="{text}"' for label, text in labels)
+            lines.append(
+                f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple = SECONDS):
+        super().__init__(name, description)
+        self.buckets = buckets
+        self._histograms: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # One count per bucket, then the sum and count of all values
+            counts = self._histograms.setdefault(key, [0] * (len(self.buckets) + 3))
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> Iterator[tuple[str, tuple, float]]:
+        with self._lock:
+            histograms = [
+                (key, list(counts)) for key, counts in self._histograms.items()
+            ]
+
+        for labels, counts in histograms:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", str(bound))), cumulative
+            yield f"{self.name}_sum", labels, counts[-2]
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+registry: list[Metric] = []
+
+render_seconds = Histogram("tempapp_render_seconds", "Time to render an output")
+render_bytes = Histogram(
+    "tempapp_render_bytes", "Size of the HTML of a rendered output", buckets=BYTES
+)
+load_seconds = Histogram("tempapp_load_seconds", "Time to load data from storage")
+rows_scanned = Counter("tempapp_rows_scanned_total", "Rows read from storage")
+ingest_seconds = Histogram("tempapp_ingest_seconds", "Time to poll and store readings")
+sessions = Gauge("tempapp_sessions", "Sessions that are currently open")
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable:
+    """Decorator that records how long each call takes"""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(histogram, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def rendered(fn: Callable) -> Callable:
+    """Decorator for render functions, recording the time and size of each output"""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timer(render_seconds, output=fn.__name__):
+            result = fn(*args, **kwargs)
+        # HTML tags, like those of ui.layout_column_wrap, by the size of their HTML
+        if isinstance(result, (str, UserString)) or hasattr(result, "tagify"):
+            render_bytes.observe(len(str(result)), output=fn.__name__)
+        return result
+
+    return wrapper
+
+
+def merge(expositions: dict[str, str], label: str) -> str:
+    """Metrics of several processes as one exposition, each sample labeled with the
+    process it came from, and each metric described once"""
+    headers: dict[str, list[str]] = {}
+    samples: dict[str, list[str]] = {}
+    for source, text in expositions.items():
+        name = ""
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                headers.setdefault(name, [])
+                samples.setdefault(name, [])
+            if line.startswith("#"):
+                if line not in headers[name]:
+                    headers[name].append(line)
+            elif line:
+                sample, labels, rest = line.partition("{")
+                if labels:
+                    line = f'{sample}{{{label}="{source}",{rest}'
+                else:
+                    sample, _, value = line.partition(" ")
+                    line = f'{sample}{{{label}="{source}"}} {value}'
+                samples[name].append(line)
+    return "".join("\n".join(headers[name] + samples[name]) + "\n" for name in headers)
+
+
+async def endpoint(request: "Request") -> "PlainTextResponse":
+    from starlette.responses import PlainTextResponse
+
+    return PlainTextResponse(
+        "\n".join(metric.format() for metric in registry) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
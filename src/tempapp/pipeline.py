@@ -1,53 +1,301 @@
+import codecs
 import json
-from datetime import datetime
+import logging
+import signal
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import cache
+from itertools import chain
 from zoneinfo import ZoneInfo
 
 import polars as pl
-from requests import get
+from polars import DataFrame
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
+from . import metrics, storage
 from .utils import SETTINGS
 
+logger = logging.getLogger(__name__)
+
+# Sensors to ask for, unless there's a list of "sensors" in the settings
+SENSORS = [
+    # 1
+    "temperature_10",
+    # 2
+    "temperature_13",
+    # 3
+    "temperature_16",
+]
+
+
+def sensors() -> list[str]:
+    return SETTINGS.get("sensors", SENSORS)
+
+
+@cache
+def http_session() -> Session:
+    """A session shared by all requests, so connections to the API are kept alive"""
+    retries = Retry(
+        total=SETTINGS.get("retries", 3),
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_maxsize=len(sensors()), max_retries=retries)
+
+    session = Session()
+    session.headers.update(SETTINGS["headers"])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def api_url(path: str) -> str:
+    """The URL of an API endpoint. The scheme can be set to "http" in the settings, for
+    a server on the local network or a stub of the API"""
+    return f"""{SETTINGS.get("scheme", "https")}://{SETTINGS["server"]}/api/{path}"""
+
+
+def get_sensor(entity: str) -> dict:
+    """Ask the API for the current state of a single sensor"""
+    url = api_url(f"states/sensor.{entity}")
+
+    response = http_session().get(url, timeout=SETTINGS.get("timeout", 10))
+    response.raise_for_status()
+    json_data = response.json()
+
+    return {
+        "floor": json_data["attributes"]["friendly_name"],
+        "temp": round(float(json_data["state"]), 1),
+    }
+
+
+@metrics.timed(metrics.ingest_seconds, step="fetch")
+def fetch_temps() -> DataFrame:
+    """Ask the API for the temps of all sensors at once, skipping any that fail"""
+    now = datetime.now(tz=ZoneInfo("Europe/Stockholm"))
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=min(len(sensors()), 16)) as pool:
+        futures = {pool.submit(get_sensor, entity): entity for entity in sensors()}
+        for future in as_completed(futures):
+            try:
+                rows.append({"time": now, **future.result()})
+            except (RequestException, KeyError, ValueError) as e:
+                logger.warning(f"Could not read sensor.{futures[future]}: {e}")
+
+    if not rows:
+        return pl.DataFrame(schema=storage.SCHEMA)
+
+    return storage.with_derived_columns(pl.DataFrame(rows).sort("floor"))
+
 
 def get_temps() -> None:
     """Ask the API for temps to update the db"""
-    # Sensors
-    entities = {
-        # 1
-        "temperature_10": {"floor": "", "temp": int},
-        # 2
-        "temperature_13": {"floor": "", "temp": int},
-        # 3
-        "temperature_16": {"floor": "", "temp": int},
-    }
+    df = fetch_temps()
+
+    if df.is_empty():
+        logger.error("None of the sensors could be read, nothing to write")
+        return
+
+    with metrics.timer(metrics.ingest_seconds, step="write"):
+        storage.write_rows(df)
+
 
-    time = datetime.now(tz=ZoneInfo("Europe/Stockholm"))
+def ingest(
+    interval: float = 60, batch_size: int = 100, flush_interval: float = 300
+) -> None:
+    """Keep polling the sensors every interval seconds, writing the readings in batches
+    of batch_size rows or at least every flush_interval seconds"""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
 
-    for entity in entities.keys():
-        url = f"""https://{SETTINGS["server"]}/api/states/sensor.{entity}"""
+    buffer: list[DataFrame] = []
+    last_flush = time.monotonic()
 
-        response = get(url, headers=SETTINGS["headers"])
-        json_data = json.loads(response.text)
-        entities[entity].update({"floor": json_data["attributes"]["friendly_name"]})
-        entities[entity].update({"temp": round(float(json_data["state"]), 1)})
+    def flush() -> None:
+        nonlocal buffer, last_flush
+        last_flush = time.monotonic()
+        if not buffer:
+            return
+        try:
+            with metrics.timer(metrics.ingest_seconds, step="write"):
+                storage.write_rows(pl.concat(buffer))
+        except Exception:
+            # None of them were stored, so keep the readings and try again on the next
+            # flush
+            logger.exception("Could not write readings")
+            return
+        logger.info(f"Wrote {sum(df.height for df in buffer)} readings")
+        buffer = []
 
-    rows = [
-        {
-            "time": time,
-            "floor": data["floor"],
-            "temp": data["temp"],
-        }
-        for data in entities.values()
-    ]
+    logger.info(f"Polling {len(sensors())} sensors every {interval} seconds")
 
-    df = (
-        pl.DataFrame(rows)
+    while not stop.is_set():
+        started = time.monotonic()
+
+        try:
+            df = fetch_temps()
+        except Exception:
+            logger.exception("Could not poll sensors")
+        else:
+            if not df.is_empty():
+                buffer.append(df)
+
+        if (
+            sum(df.height for df in buffer) >= batch_size
+            or time.monotonic() - last_flush >= flush_interval
+        ):
+            flush()
+
+        stop.wait(max(interval - (time.monotonic() - started), 0))
+
+    logger.info("Shutting down, writing buffered readings")
+    flush()
+
+
+def history_states(chunks: Iterable[bytes]) -> Iterator[tuple[int, dict]]:
+    """The states in a response from /api/history/period, which is a list with a list
+    of states for each entity, along with the index of the entity they belong to.
+    Parsed as the chunks come in, so no more than a chunk and a state is held at once"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, depth, entity = "", 0, 0, -1
+
+    for chunk in chain(chunks, [None]):
+        buffer = buffer[pos:] + text.decode(chunk or b"", final=chunk is None)
+        pos = 0
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char in " \t\r\n,":
+                pos += 1
+            elif char == "[":
+                depth += 1
+                pos += 1
+                if depth == 2:
+                    entity += 1
+            elif char == "]":
+                depth -= 1
+                pos += 1
+            elif char == "{" and depth == 2:
+                try:
+                    state, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # The rest of the state is in the next chunk
+                    break
+                yield entity, state
+            else:
+                raise ValueError(f"Unexpected {char!r} in the history response")
+
+    if depth or buffer[pos:].strip():
+        raise ValueError("The history response ended before it was complete")
+
+
+def fetch_history(start: datetime, end: datetime) -> DataFrame:
+    """The readings of all sensors between two times, from the history of the API"""
+    response = http_session().get(
+        api_url(f"history/period/{start.isoformat()}"),
+        params={
+            "end_time": end.isoformat(),
+            "filter_entity_id": ",".join(f"sensor.{entity}" for entity in sensors()),
+            # Only the first state of each entity with its attributes
+            "minimal_response": "",
+        },
+        timeout=SETTINGS.get("timeout", 10),
+        stream=True,
+    )
+
+    times, floors, temps = [], [], []
+    with response:
+        response.raise_for_status()
+        floor = None
+        last_entity = -1
+        for entity, state in history_states(response.iter_content(2**16)):
+            if entity != last_entity:
+                floor = state["attributes"]["friendly_name"]
+                last_entity = entity
+            try:
+                temp = round(float(state["state"]), 1)
+            except ValueError:
+                # "unavailable" or "unknown"
+                continue
+            times.append(state["last_changed"])
+            floors.append(floor)
+            temps.append(temp)
+
+    return (
+        pl.DataFrame(
+            {"time": times, "floor": floors, "temp": temps},
+            schema={"time": pl.String, "floor": pl.String, "temp": pl.Float64},
+        )
         .with_columns(
-            hour=pl.col("time").dt.truncate("1h").dt.strftime("%H:%M"),
-            date_iso=pl.col("time").dt.strftime("%Y-%m-%d"),
-            day=pl.col("time").dt.truncate("1d"),
-            time_trunc=pl.col("time").dt.truncate("1h"),
+            pl.col("time")
+            .str.to_datetime(time_unit="us", time_zone="UTC")
+            .dt.convert_time_zone("Europe/Stockholm")
         )
-        .select("time", "floor", "temp", "time_trunc", "day", "date_iso", "hour")
+        # Each entity starts with the state it had at the start, given the start as
+        # its time, which is a repeat of a reading from before
+        .filter(pl.col("time") > start)
     )
 
-    pl.read_parquet(SETTINGS["data"]).vstack(df).write_parquet(SETTINGS["data"])
+
+def new_rows(df: DataFrame) -> DataFrame:
+    """The rows that aren't already stored, with the same time and floor"""
+    if df.is_empty():
+        return df
+
+    df = df.unique(["time", "floor"], keep="first")
+    with storage.reading():
+        stored = (
+            storage.scan(df["time"].min(), df["time"].max() + timedelta(microseconds=1))
+            .select("time", pl.col("floor").cast(pl.String))
+            .collect()
+        )
+    return df.join(stored, on=["time", "floor"], how="anti").sort("time")
+
+
+def backfill(
+    start: datetime,
+    end: datetime,
+    page: timedelta = timedelta(days=1),
+    batch_size: int = 100_000,
+) -> None:
+    """Fill in the readings between two times from the history of the API, asking for
+    a page of time at a time and writing in batches of at least batch_size rows.
+    Readings that are already stored are skipped, so it's safe to run again"""
+    tz = ZoneInfo("Europe/Stockholm")
+    start, end = start.astimezone(tz), end.astimezone(tz)
+
+    buffer: list[DataFrame] = []
+    written = 0
+
+    def flush() -> None:
+        nonlocal buffer, written
+        if not buffer:
+            return
+        rows = new_rows(pl.concat(buffer))
+        buffer = []
+        if rows.is_empty():
+            return
+        with metrics.timer(metrics.ingest_seconds, step="backfill"):
+            storage.write_rows(storage.with_derived_columns(rows))
+        written += rows.height
+        logger.info(f"Wrote {rows.height} readings, up to {rows['time'].max()}")
+
+    logger.info(f"Backfilling {len(sensors())} sensors from {start} to {end}")
+    page_start = start
+    while page_start < end:
+        page_end = min(page_start + page, end)
+        buffer.append(fetch_history(page_start, page_end))
+        if sum(df.height for df in buffer) >= batch_size:
+            flush()
+        page_start = page_end
+    flush()
+
+    logger.info(f"Backfilled {written} readings")
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import zlib
+from functools import partial
+
+import uvicorn
+
+from . import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+# The request line and headers of the first request on a connection have to fit in
+# this many bytes, which is what the choice of worker is based on
+MAX_HEAD = 64 * 1024
+
+
+def client_key(head: bytes, peer: str) -> str:
+    """Who a connection comes from: the first address in X-Forwarded-For when there's
+    another proxy in front, otherwise the address of the peer"""
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"x-forwarded-for" and value.strip():
+            return value.split(b",")[0].strip().decode("latin-1")
+    return peer
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Copy everything from one side of a connection to the other, until it ends"""
+    try:
+        while data := await reader.read(2**16):
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+
+
+def is_metrics(head: bytes) -> bool:
+    """Whether a request is for the metrics, which every worker keeps its own of"""
+    method, _, rest = head.partition(b" ")
+    return method == b"GET" and rest.split(b" ")[0].split(b"?")[0] == b"/metrics"
+
+
+async def scrape(port: int) -> str:
+    """The metrics of one worker"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    return response.partition(b"\r\n\r\n")[2].decode()
+
+
+async def metrics_response(ports: list[int]) -> bytes:
+    """The metrics of all workers, each labeled with the number of its worker.
+    Workers that don't answer are left out"""
+    responses = await asyncio.gather(
+        *(scrape(port) for port in ports), return_exceptions=True
+    )
+    body = metrics.merge(
+        {
+            str(worker): text
+            for worker, text in enumerate(responses, start=1)
+            if isinstance(text, str)
+        },
+        label="worker",
+    ).encode()
+    return (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/plain; version=0.0.4\r\n"
+        b"Content-Length: %d\r\n"
+        b"Connection: close\r\n\r\n" % len(body)
+    ) + body
+
+
+async def forward(
+    ports: list[int],
+    client_reader: asyncio.StreamReader,
+    client_writer: asyncio.StreamWriter,
+) -> None:
+    """Send a connection to the worker of its client. The same client always ends up
+    at the same worker, so the page, its websocket and any reconnects of a Shiny
+    session are all handled by the process that holds that session. The metrics are
+    gathered from all workers instead"""
+    peer = client_writer.get_extra_info("peername")[0]
+    try:
+        head = await client_reader.readuntil(b"\r\n\r\n")
+        if is_metrics(head):
+            client_writer.write(await metrics_response(ports))
+            await client_writer.drain()
+            client_writer.close()
+            return
+        backend_reader, backend_writer = await asyncio.open_connection(
+            "127.0.0.1", ports[zlib.crc32(client_key(head, peer).encode()) % len(ports)]
+        )
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        client_writer.close()
+        return
+
+    backend_writer.write(head)
+    await asyncio.gather(
+        pipe(client_reader, backend_writer), pipe(backend_reader, client_writer)
+    )
+    backend_writer.close()
+    client_writer.close()
+
+
+async def proxy(host: str, port: int, ports: list[int]) -> None:
+    """Accept connections on the public port until told to stop"""
+    server = await asyncio.start_server(
+        partial(forward, ports), host, port, limit=MAX_HEAD
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"Sticky proxy on http://{host}:{port} to {len(ports)} workers")
+    async with server:
+        await stop.wait()
+
+
+def run(workers: int, host: str = "0.0.0.0", port: int = 8000) -> None:
+    """Serve the app from a number of worker processes, listening on the ports right
+    after the public one, behind a proxy that keeps every client on one worker"""
+    # Export the dataset once, before any of the workers go looking for it
+    storage.hot_copy()
+    os.environ["TEMPAPP_WORKERS"] = str(workers)
+
+    ports = [port + i for i in range(1, workers + 1)]
+    # Spawn rather than fork, Polars' thread pool doesn't survive a fork
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=uvicorn.run,
+            args=("tempapp.app:app",),
+            kwargs={"host": "127.0.0.1", "port": worker_port},
+            daemon=True,
+        )
+        for worker_port in ports
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(proxy(host, port, ports))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -0,0 +1,100 @@
+from datetime import date, datetime, time, timedelta
+from functools import cache
+from zoneinfo import ZoneInfo
+
+import duckdb
+import polars as pl
+from polars import DataFrame
+
+from . import metrics, storage, utils
+
+# The start of the bucket of each reading in every rollup. Hours are counted from the
+# epoch, as the hour that comes twice when the clocks go back is ambiguous in Swedish
+# time, and days start at midnight in Swedish time
+BUCKETS = {
+    "hourly": "to_timestamp(floor(epoch(time) / 3600) * 3600)",
+    "daily": "date_trunc('day', time)",
+}
+
+ROLLUP_SCHEMA = pl.Schema(
+    {
+        "time": pl.Datetime("us", "Europe/Stockholm"),
+        "floor": pl.String,
+        "count": pl.UInt32,
+        "mean": pl.Float64,
+        "std": pl.Float64,
+        "min": pl.Float64,
+        "max": pl.Float64,
+    }
+)
+
+# Like storage.rollup, for each floor and the whole house. Files written before the
+# compact schema have the temp as a 64 bit float, which union_by_name reconciles
+ROLLUP = """
+with buckets as (
+    select
+        {bucket} as time,
+        floor::varchar as floor,
+        round(temp::double, 4) as temp
+    from read_parquet($files, union_by_name = true, hive_partitioning = false)
+    where time >= $start and time < $end
+),
+sums as (
+    select * from buckets
+    union all
+    select time, 'Huset', temp from buckets
+)
+select
+    time,
+    floor,
+    count(*)::uinteger as count,
+    avg(temp) as mean,
+    coalesce(stddev_samp(temp), 0) as std,
+    min(temp) as min,
+    max(temp) as max
+from sums
+group by time, floor
+order by time, floor
+"""
+
+
+@cache
+def connection() -> duckdb.DuckDBPyConnection:
+    """An in-memory database in Swedish time, which spills to disk rather than use
+    more memory than "duckdb_memory_limit" in the settings, like "512MB" """
+    config = {}
+    if limit := utils.SETTINGS.get("duckdb_memory_limit"):
+        config["memory_limit"] = limit
+    con = duckdb.connect(config=config)
+    # Global, so that the cursors of every thread are in Swedish time too
+    con.execute("SET GLOBAL TimeZone = 'Europe/Stockholm'")
+    return con
+
+
+def query(sql: str, **params) -> DataFrame:
+    """Run a query and hand the result to Polars through the Arrow C stream interface,
+    without copying it. Every query gets its own cursor, as charts are rendered in
+    several threads at once"""
+    return pl.DataFrame(connection().cursor().sql(sql, params=params))
+
+
+def rollup(name: str, start: date, end: date) -> DataFrame:
+    """Mean, standard deviation, min and max temps of every bucket between two dates,
+    aggregated from the raw data files rather than read from the stored rollups"""
+    tz = ZoneInfo("Europe/Stockholm")
+    first = datetime.combine(start, time(), tz)
+    last = datetime.combine(end + timedelta(days=1), time(), tz)
+
+    with storage.reading():
+        paths = storage.files(first, last)
+        if not paths:
+            return pl.DataFrame(schema=ROLLUP_SCHEMA)
+
+        df = query(
+            ROLLUP.format(bucket=BUCKETS[name]),
+            files=[str(path) for path in paths],
+            start=first,
+            end=last,
+        )
+    metrics.rows_scanned.inc(df.height, source=name)
+    return df
@@ -0,0 +1,856 @@
+import fcntl
+import importlib.util
+import logging
+import os
+import shutil
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from functools import cache
+from itertools import groupby
+from pathlib import Path
+from typing import TypeVar
+from zoneinfo import ZoneInfo
+
+import polars as pl
+from polars import DataFrame, LazyFrame
+
+from . import metrics, utils
+
+logger = logging.getLogger(__name__)
+
+# The columns of the readings that the dashboard works with, in order
+SCHEMA = pl.Schema(
+    {
+        "time": pl.Datetime("us", "Europe/Stockholm"),
+        "floor": pl.String,
+        "temp": pl.Float64,
+        "time_trunc": pl.Datetime("us", "Europe/Stockholm"),
+        "day": pl.Datetime("us", "Europe/Stockholm"),
+        "date_iso": pl.String,
+        "hour": pl.String,
+    }
+)
+
+# The columns that are stored, in compact types: the floor is a category and the temp
+# a 32 bit float. Everything else is derived from the time when read
+STORED_SCHEMA = pl.Schema(
+    {
+        "time": pl.Datetime("us", "Europe/Stockholm"),
+        "floor": pl.Categorical(),
+        "temp": pl.Float32,
+    }
+)
+
+Frame = TypeVar("Frame", DataFrame, LazyFrame)
+
+# Floors are categories in every file and frame, so they have to share one mapping
+pl.enable_string_cache()
+
+# Hive style layout of the dataset directory, one directory per month
+PARTITION = "year={year}/month={month:02d}"
+PARTITION_GLOB = "year=*/month=*/*.parquet"
+
+VERSION_FILE = "_version"
+
+# Rows are sorted on time within each file, and every row group gets min/max
+# statistics, so scans filtered on time can skip the row groups they don't need
+ROW_GROUP_SIZE = 16_384
+
+# What `tempapp compact` writes each partition as, unless told otherwise: zstd at level 9
+# is about 6% smaller than at its default level, and just as fast to read
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 9
+
+# Aggregates kept next to the raw data, and the bucket size of each. Each is a
+# directory with a file per month, like the raw data, so a write only rewrites the
+# months it adds to
+ROLLUPS = {"hourly": "1h", "daily": "1d"}
+ROLLUP_FILE = "{year}-{month:02d}.parquet"
+
+# Left next to the rollups when a write couldn't update them, so they are rebuilt
+STALE_ROLLUPS = "rollups.stale"
+
+# The tiers of the dataset, finest first. How many days of each are kept is set by
+# "retention" in the settings, like {"raw": 90, "hourly": 730}, and a tier without a
+# number of days is kept forever
+TIERS = ("raw", *ROLLUPS)
+
+# Writes that are added to the hot copy as files of their own before it's exported
+# from the archive again, which also drops the days that fell out of hot_days
+HOT_SEGMENTS = 64
+
+
+def data_path() -> Path:
+    return Path(utils.SETTINGS["data"])
+
+
+def is_partitioned() -> bool:
+    """The dataset is a directory, unless it's still a single (legacy) Parquet file"""
+    return not data_path().is_file()
+
+
+def files(start: datetime | None = None, end: datetime | None = None) -> list[Path]:
+    """The data files of the dataset, oldest partition first. With a start and/or end,
+    only the files of the months that overlap with that range"""
+    if not is_partitioned():
+        return [data_path()]
+
+    paths = sorted(data_path().glob(PARTITION_GLOB))
+    if start is None and end is None:
+        return paths
+
+    tz = ZoneInfo("Europe/Stockholm")
+    first = (start.astimezone(tz).year, start.astimezone(tz).month) if start else None
+    last = (end.astimezone(tz).year, end.astimezone(tz).month) if end else None
+
+    return [
+        path
+        for path in paths
+        if (first is None or _partition_of(path) >= first)
+        and (last is None or _partition_of(path) <= last)
+    ]
+
+
+def meta_path(name: str) -> Path:
+    """Where to keep files that belong to the dataset, but aren't raw data"""
+    if is_partitioned():
+        return data_path() / f"_{name}"
+    return data_path().with_name(f"{data_path().stem}_{name}")
+
+
+def version() -> int:
+    """A number that changes every time new data is written"""
+    if not is_partitioned():
+        return data_path().stat().st_mtime_ns
+
+    try:
+        return int((data_path() / VERSION_FILE).read_text())
+    except FileNotFoundError:
+        return 0
+
+
+def bump_version() -> int:
+    """Tell readers that the dataset has changed"""
+    new_version = version() + 1
+    _write_atomic(data_path() / VERSION_FILE, str(new_version).encode())
+    return new_version
+
+
+@contextmanager
+def reading() -> Iterator[None]:
+    """Keep `tempapp compact` from swapping data files while they are listed and read,
+    so that a read sees either all files from before a swap or all from after it"""
+    if not data_path().exists():
+        yield
+        return
+    with _locked(meta_path("swap.lock"), shared=True):
+        yield
+
+
+@contextmanager
+def writing() -> Iterator[None]:
+    """Only one process at a time adds to or rewrites the dataset and its rollups"""
+    if is_partitioned():
+        data_path().mkdir(parents=True, exist_ok=True)
+    with _locked(meta_path("write.lock")):
+        yield
+
+
+def read(paths: list[Path] | None = None) -> DataFrame:
+    """Read the whole dataset, or only some of its files, in the stored schema"""
+    with reading():
+        paths = files() if paths is None else paths
+        df = _scan_files(paths).collect()
+    metrics.rows_scanned.inc(df.height, source="raw")
+    return df
+
+
+def compact(df: Frame) -> Frame:
+    """Only the stored columns of readings, in their compact types"""
+    return df.select(pl.col(name).cast(dtype) for name, dtype in STORED_SCHEMA.items())
+
+
+def temp() -> pl.Expr:
+    """The temp as a 64 bit float again. A 32 bit float holds about 7 significant
+    digits, so any temp stored with up to 4 decimals comes back as it was"""
+    return pl.col("temp").cast(pl.Float64).round(4)
+
+
+def with_derived_columns(df: DataFrame) -> DataFrame:
+    """Add the columns derived from the time of each reading, in the order of SCHEMA,
+    with the floor as text and the temp as a 64 bit float"""
+    return df.with_columns(
+        floor=pl.col("floor").cast(pl.String),
+        temp=temp(),
+        hour=pl.col("time").dt.truncate("1h").dt.strftime("%H:%M"),
+        date_iso=pl.col("time").dt.strftime("%Y-%m-%d"),
+        day=pl.col("time").dt.truncate("1d"),
+        time_trunc=pl.col("time").dt.truncate("1h"),
+    ).select(SCHEMA.names())
+
+
+def scan(start: datetime | None = None, end: datetime | None = None) -> LazyFrame:
+    """Lazily scan the dataset in the stored schema, optionally only rows with
+    start <= time < end"""
+    lf = _scan_files(files(start, end))
+    if start is not None:
+        lf = lf.filter(pl.col("time") >= start)
+    if end is not None:
+        lf = lf.filter(pl.col("time") < end)
+    return lf
+
+
+def latest() -> datetime | None:
+    """Time of the latest reading, only looking in the latest partition"""
+    with reading():
+        paths = files()
+        if not paths:
+            return None
+
+        newest = [path for path in paths if path.parent == paths[-1].parent]
+        return _scan_files(newest).select(pl.col("time").max()).collect().item()
+
+
+def earliest(tier: str = "raw") -> datetime | None:
+    """Time of the oldest reading, only looking in the oldest partition, or of the
+    oldest bucket of a rollup"""
+    if tier != "raw":
+        paths = rollup_files(tier)
+        if not paths:
+            return None
+        return pl.scan_parquet(paths[0]).select(pl.col("time").min()).collect().item()
+
+    with reading():
+        paths = files()
+        if not paths:
+            return None
+
+        oldest = [path for path in paths if path.parent == paths[0].parent]
+        return _scan_files(oldest).select(pl.col("time").min()).collect().item()
+
+
+def recent(hours: int = 24, df: DataFrame | None = None) -> DataFrame:
+    """All rows from the last hours before the hour of the latest reading, and onwards.
+    Scanned from disk, or filtered from a frame of the whole dataset if one is given"""
+    last = latest() if df is None else df.select(pl.col("time").max()).item()
+    if last is None:
+        return pl.DataFrame(schema=SCHEMA)
+
+    last_hour = last.replace(minute=0, second=0, microsecond=0)
+    start, end = last_hour - timedelta(hours=hours), last + timedelta(seconds=1)
+    if df is None:
+        with reading():
+            df = scan(start, end).collect()
+    else:
+        df = df.filter(pl.col("time").is_between(start, end, closed="left"))
+    metrics.rows_scanned.inc(df.height, source="recent")
+    return with_derived_columns(df)
+
+
+def backend() -> str:
+    """Where the dashboard reads from: "parquet" reads the archive itself, "arrow"
+    memory-maps a hot Arrow IPC copy of it, which is kept up to date on every write"""
+    return utils.SETTINGS.get("backend", "parquet")
+
+
+@cache
+def engine() -> str:
+    """What the long term views are queried with: "polars" reads the rollups kept next
+    to the archive, "duckdb" aggregates the archive itself with DuckDB, out of core"""
+    name = utils.SETTINGS.get("engine", "polars")
+    if name == "duckdb" and importlib.util.find_spec("duckdb") is None:
+        logger.warning("The duckdb engine needs the duckdb package, using polars")
+        return "polars"
+    return name
+
+
+def retention_cutoff(tier: str) -> datetime | None:
+    """The start of the oldest day to keep of a tier, or None if all of it is kept.
+    Always midnight, so that no hourly or daily bucket is cut in two"""
+    days = utils.SETTINGS.get("retention", {}).get(tier)
+    if days is None:
+        return None
+    if tier == "raw":
+        # Never less than the dashboard needs from the raw rows
+        days = max(days, 2)
+
+    tz = ZoneInfo("Europe/Stockholm")
+    return datetime.combine(datetime.now(tz).date() - timedelta(days=days), time(), tz)
+
+
+def hot_days() -> int | None:
+    """How many days back from the latest reading the hot copy holds, or None for all"""
+    days = utils.SETTINGS.get("hot_days")
+    # Never less than the dashboard needs from the raw rows
+    return None if days is None else max(days, 2)
+
+
+def hot_copy() -> list[Path]:
+    """An uncompressed Arrow IPC copy of the current version of the dataset: a file
+    exported from the archive, followed by a file of the rows of each write since.
+    Exported by whichever process asks for it first. Memory-mapping it lets every
+    process share the same pages through the page cache instead of each decoding its
+    own copy"""
+    current = version()
+    if (segments := _hot_segments(current)) is None:
+        export = meta_path("hot") / f"v{current}" / f"v{current}.arrow"
+        _write_hot(export, _hot_rows)
+        segments = [export]
+    return segments
+
+
+def has_hot_copy() -> bool:
+    return meta_path("hot").is_dir() and any(meta_path("hot").glob("v*"))
+
+
+def update_hot(df: DataFrame) -> None:
+    """Add new rows to the hot copy, as a file of their own after the copy of the
+    version before, rather than exporting the whole archive again. Once there are
+    HOT_SEGMENTS of those, the copy is exported anew"""
+    current = version()
+    segments = _hot_segments(current - 1) if is_partitioned() else None
+    if segments is None or len(segments) > HOT_SEGMENTS:
+        _write_hot(meta_path("hot") / f"v{current}" / f"v{current}.arrow", _hot_rows)
+    else:
+        _write_hot(segments[0].parent / f"v{current}.arrow", lambda: compact(df))
+
+
+def write_rows(df: DataFrame) -> None:
+    """Add new rows to the dataset, without touching what is already stored. If it
+    raises, none of the rows were stored, so they can be written again"""
+    with writing():
+        _store_rows(df)
+
+        # The rows are stored from here on, and the rest is derived from them. Failures
+        # are logged and repaired later rather than raised, which would have the caller
+        # write the same rows again
+        try:
+            update_rollups(df)
+        except Exception:
+            logger.exception("Could not update the rollups, they will be rebuilt")
+            _write_atomic(meta_path(STALE_ROLLUPS), b"")
+
+        if is_partitioned():
+            bump_version()
+
+        # Workers map the hot copy whatever the backend, so keep any that exists
+        if backend() == "arrow" or has_hot_copy():
+            try:
+                update_hot(df)
+            except Exception:
+                logger.exception("Could not update the hot copy, it will be exported")
+
+
+def partition() -> None:
+    """Turn a legacy single Parquet file into a partitioned dataset in its place"""
+    if is_partitioned():
+        print(f"{data_path()} is already a partitioned dataset")
+        return
+
+    backup = data_path().with_name(data_path().name + ".bak")
+    shutil.move(data_path(), backup)
+    data_path().mkdir()
+
+    write_rows(pl.read_parquet(backup))
+    print(f"Partitioned {data_path()}, the old file is kept at {backup}")
+
+
+def aggregate(df: DataFrame, every: str) -> DataFrame:
+    """Sums of the temps for each floor and the whole house in buckets of a given size,
+    which can be added up with other sums of the same buckets later on"""
+    buckets = df.with_columns(
+        pl.col("time").dt.truncate(every),
+        pl.col("floor").cast(pl.String),
+        temp(),
+    )
+    sums = (
+        pl.len().alias("count"),
+        pl.col("temp").sum().alias("sum"),
+        (pl.col("temp") ** 2).sum().alias("sum_sq"),
+        pl.col("temp").min().alias("min"),
+        pl.col("temp").max().alias("max"),
+    )
+
+    per_floor = buckets.group_by("time", "floor").agg(*sums)
+    house = buckets.group_by("time").agg(*sums).with_columns(floor=pl.lit("Huset"))
+
+    return pl.concat([per_floor, house.select(per_floor.columns)])
+
+
+def merge_aggregates(*dfs: DataFrame) -> DataFrame:
+    return (
+        pl.concat(dfs)
+        .group_by("time", "floor")
+        .agg(
+            pl.col("count").sum(),
+            pl.col("sum").sum(),
+            pl.col("sum_sq").sum(),
+            pl.col("min").min(),
+            pl.col("max").max(),
+        )
+        .sort("time", "floor")
+    )
+
+
+def rollup_files(
+    name: str, start: date | None = None, end: date | None = None
+) -> list[Path]:
+    """The month files of a rollup, oldest first. With a start and/or end, only the
+    files of the months that overlap with that range"""
+    return [
+        path
+        for path in sorted(meta_path(name).glob("*.parquet"))
+        if (start is None or _month_of(path) >= (start.year, start.month))
+        and (end is None or _month_of(path) <= (end.year, end.month))
+    ]
+
+
+def update_rollups(df: DataFrame) -> None:
+    """Add new rows to the hourly and daily rollups, rewriting only the months that
+    the rows belong to"""
+    if not has_rollups():
+        # The new rows are already stored, so they'll be part of the rebuild
+        rebuild_rollups()
+        return
+
+    for name, every in ROLLUPS.items():
+        _write_rollup(name, aggregate(df, every))
+
+
+def has_rollups() -> bool:
+    return (
+        all(meta_path(name).is_dir() for name in ROLLUPS)
+        and not meta_path(STALE_ROLLUPS).exists()
+    )
+
+
+def ensure_rollups() -> None:
+    """Build the rollups if they are missing. Readers in several threads and processes
+    can find them missing at once, so only the first to get the write lock builds them"""
+    if has_rollups():
+        return
+    with writing():
+        if not has_rollups():
+            rebuild_rollups()
+
+
+def rebuild_rollups() -> None:
+    """Compute all rollups from the raw data again, one partition at a time"""
+    oldest = earliest()
+    rebuilt: dict[str, set[Path]] = {name: set() for name in ROLLUPS}
+
+    for name, every in ROLLUPS.items():
+        meta_path(name).mkdir(parents=True, exist_ok=True)
+
+        # The buckets from before the oldest raw reading only live on in the rollups,
+        # once `tempapp retain` has dropped their readings. Rollups from before they
+        # were split by month are a single file, which is carried over
+        kept = [_scan_rollup(name)]
+        if (single := meta_path(f"{name}.parquet")).exists():
+            kept.append(pl.scan_parquet(single))
+        lf = pl.concat(kept)
+        if oldest is not None:
+            lf = lf.filter(pl.col("time") < pl.lit(oldest).dt.truncate(every))
+        _write_rollup(name, lf.collect(), rebuilt[name])
+
+    for _, paths in groupby(files(), key=lambda path: path.parent):
+        df = _scan_files(list(paths)).collect()
+        for name, every in ROLLUPS.items():
+            _write_rollup(name, aggregate(df, every), rebuilt[name])
+
+    # Months that no longer have any readings
+    for name in ROLLUPS:
+        for path in rollup_files(name):
+            if path not in rebuilt[name]:
+                path.unlink()
+        meta_path(f"{name}.parquet").unlink(missing_ok=True)
+    meta_path(STALE_ROLLUPS).unlink(missing_ok=True)
+
+
+def rollup(name: str, start: date, end: date) -> DataFrame:
+    """Mean, standard deviation, min and max temps of every bucket between two dates.
+    Days that are past the retention of the rollup come from the next, coarser one,
+    and the tier of each row says which rollup it came from"""
+    if engine() == "duckdb" and (
+        (oldest := earliest()) is None or start >= oldest.date()
+    ):
+        from . import sql
+
+        return sql.rollup(name, start, end).with_columns(tier=pl.lit(name))
+
+    ensure_rollups()
+
+    coarser = TIERS[TIERS.index(name) + 1 :]
+    if coarser and (oldest := earliest(name)) is not None and start < oldest.date():
+        return pl.concat(
+            [
+                rollup(coarser[0], start, min(end, oldest.date() - timedelta(days=1))),
+                rollup(name, oldest.date(), end),
+            ]
+        )
+
+    df = (
+        _scan_rollup(name, start, end)
+        .filter(pl.col("time").dt.date().is_between(start, end))
+        .with_columns(
+            mean=pl.col("sum") / pl.col("count"),
+            # Sample standard deviation, like pl.col("temp").std()
+            std=pl.when(pl.col("count") > 1)
+            .then(
+                (
+                    (pl.col("sum_sq") - pl.col("sum") ** 2 / pl.col("count")).clip(0)
+                    / (pl.col("count") - 1)
+                ).sqrt()
+            )
+            .otherwise(0.0),
+        )
+        .select(
+            "time", "floor", "count", "mean", "std", "min", "max", tier=pl.lit(name)
+        )
+        .collect()
+    )
+    metrics.rows_scanned.inc(df.height, source=name)
+    return df
+
+
+def migrate() -> None:
+    """Rewrite the data files that are still in the wide schema, with the derived
+    columns and full width types, in the compact stored schema"""
+    before = after = 0
+    for path in files():
+        if pl.read_parquet_schema(path) == dict(STORED_SCHEMA):
+            continue
+
+        before += path.stat().st_size
+        _write_parquet_atomic(compact(pl.read_parquet(path)).sort("time"), path)
+        after += path.stat().st_size
+
+    if before == 0:
+        print(f"{data_path()} is already in the compact schema")
+        return
+
+    if is_partitioned():
+        bump_version()
+    print(f"Migrated {data_path()}, from {before:,} to {after:,} bytes")
+
+
+def compact_files(
+    compression: str = COMPRESSION,
+    level: int | None = COMPRESSION_LEVEL,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> None:
+    """Rewrite each partition as a single file, without duplicate readings, sorted on
+    time, and with the given compression and row groups. Partitions are streamed to
+    their new file one at a time, so memory use doesn't grow with the dataset.
+    Partitions that are already a single file written like that are left alone"""
+    name = f"compact-{compression}-{level or 'default'}-{row_group_size}.parquet"
+    rewritten = before = after = duplicates = 0
+
+    with writing():
+        if is_partitioned():
+            partitions = [
+                list(paths) for _, paths in groupby(files(), lambda p: p.parent)
+            ]
+        else:
+            partitions = [[data_path()]]
+
+        for paths in partitions:
+            target = paths[0].parent / name if is_partitioned() else data_path()
+            if paths == [target] and is_partitioned():
+                continue
+
+            rows = _scan_files(paths).select(pl.len()).collect().item()
+            before += sum(path.stat().st_size for path in paths)
+
+            _replace_files(
+                paths,
+                _scan_files(paths).unique(["time", "floor"], keep="first").sort("time"),
+                target,
+                compression=compression,
+                compression_level=level,
+                row_group_size=row_group_size,
+            )
+
+            duplicates += (
+                rows - pl.scan_parquet(target).select(pl.len()).collect().item()
+            )
+            after += target.stat().st_size
+            rewritten += 1
+
+        if duplicates:
+            rebuild_rollups()
+
+    if not rewritten:
+        print(f"{data_path()} is already compacted")
+        return
+    print(
+        f"Compacted {rewritten} partitions of {data_path()}, from {before:,} to"
+        f" {after:,} bytes, removing {duplicates:,} duplicate readings"
+    )
+
+
+def retain() -> None:
+    """Drop what is past the retention of each tier, which the next tier still holds
+    the aggregates of. Months of raw readings that are past it as a whole are removed,
+    and a month that is only partly past it is rewritten without the older readings"""
+    dropped = {}
+    with writing():
+        # Every reading has to be part of the rollups before it's dropped
+        if not has_rollups():
+            rebuild_rollups()
+
+        if (cutoff := retention_cutoff("raw")) is not None:
+            dropped["raw"] = _drop_readings(cutoff)
+
+        for name in ROLLUPS:
+            if (cutoff := retention_cutoff(name)) is None:
+                continue
+            dropped[name] = 0
+            for path in rollup_files(name, end=cutoff.date()):
+                df = pl.read_parquet(path)
+                kept = df.filter(pl.col("time") >= cutoff)
+                dropped[name] += df.height - kept.height
+                if kept.is_empty():
+                    path.unlink()
+                elif kept.height < df.height:
+                    _write_parquet_atomic(kept, path)
+
+    if not dropped:
+        print("No retention is set in the settings, everything is kept")
+    for tier, rows in dropped.items():
+        print(f"Dropped {rows:,} {tier} rows from before {retention_cutoff(tier)}")
+
+
+def _drop_readings(cutoff: datetime) -> int:
+    """Remove the raw readings from before a time, returning how many there were"""
+    if is_partitioned():
+        partitions = [
+            list(paths) for _, paths in groupby(files(end=cutoff), lambda p: p.parent)
+        ]
+    else:
+        partitions = [[data_path()]]
+
+    dropped = 0
+    for paths in partitions:
+        rows, old = (
+            _scan_files(paths)
+            .select(pl.len(), (pl.col("time") < cutoff).sum())
+            .collect()
+            .row(0)
+        )
+        if not old:
+            continue
+
+        if old == rows and is_partitioned():
+            with _locked(meta_path("swap.lock")):
+                for path in paths:
+                    path.unlink()
+                month = paths[0].parent
+                month.rmdir()
+                if not any(month.parent.iterdir()):
+                    month.parent.rmdir()
+                bump_version()
+        else:
+            target = paths[0].parent / _part_name() if is_partitioned() else data_path()
+            _replace_files(
+                paths,
+                _scan_files(paths).filter(pl.col("time") >= cutoff),
+                target,
+                row_group_size=ROW_GROUP_SIZE,
+            )
+        dropped += old
+
+    return dropped
+
+
+def _replace_files(paths: list[Path], lf: LazyFrame, target: Path, **options) -> None:
+    """Stream a frame to a file that takes the place of some data files, all at once
+    for readers. The options are passed on to sink_parquet"""
+    tmp = _tmp_path(target)
+    lf.sink_parquet(tmp, statistics=True, **options)
+
+    # Readers wait for the swap, and a process killed halfway through it leaves
+    # duplicates at worst, which `tempapp compact` removes
+    with _locked(meta_path("swap.lock")):
+        os.replace(tmp, target)
+        for path in paths:
+            if path != target:
+                path.unlink()
+        if is_partitioned():
+            bump_version()
+
+
+def _store_rows(df: DataFrame) -> None:
+    """Write rows to a new file in each month they belong to, removing the files that
+    were written if any of them fails"""
+    if not is_partitioned():
+        # Legacy single file, which has to be rewritten in full
+        _write_parquet_atomic(
+            compact(pl.read_parquet(data_path())).vstack(compact(df)).sort("time"),
+            data_path(),
+        )
+        return
+
+    written = []
+    try:
+        for (year, month), rows in df.group_by(
+            pl.col("time").dt.year().alias("year"),
+            pl.col("time").dt.month().alias("month"),
+        ):
+            partition = data_path() / PARTITION.format(year=year, month=month)
+            partition.mkdir(parents=True, exist_ok=True)
+            path = partition / _part_name()
+            _write_parquet_atomic(compact(rows).sort("time"), path)
+            written.append(path)
+    except BaseException:
+        for path in written:
+            path.unlink(missing_ok=True)
+        raise
+
+
+def _scan_files(paths: list[Path]) -> LazyFrame:
+    """Scan data files in the stored schema, whether they were written in it or in
+    the wide schema from before"""
+    if not paths:
+        return pl.LazyFrame(schema=STORED_SCHEMA)
+    return pl.concat([_scan_file(path) for path in paths])
+
+
+def _scan_file(path: Path) -> LazyFrame:
+    """Scan a data file in the stored schema. Only the columns stored in another type
+    are cast, so filters on the time are still pushed down into the scan"""
+    lf = pl.scan_parquet(path, hive_partitioning=False)
+    schema = lf.collect_schema()
+    return lf.select(
+        pl.col(name) if schema.get(name) == dtype else pl.col(name).cast(dtype)
+        for name, dtype in STORED_SCHEMA.items()
+    )
+
+
+def _scan_rollup(
+    name: str, start: date | None = None, end: date | None = None
+) -> LazyFrame:
+    """Scan the month files of a rollup, optionally only those of the months that
+    overlap with a range"""
+    if not (paths := rollup_files(name, start, end)):
+        return aggregate(pl.DataFrame(schema=STORED_SCHEMA), ROLLUPS[name]).lazy()
+    return pl.scan_parquet(paths)
+
+
+def _write_rollup(name: str, df: DataFrame, rebuilt: set[Path] | None = None) -> None:
+    """Add aggregates to the month files of a rollup. When rebuilding, a month that
+    isn't in rebuilt yet is started over rather than added to, and then added to it"""
+    for (year, month), rows in df.group_by(
+        pl.col("time").dt.year().alias("year"),
+        pl.col("time").dt.month().alias("month"),
+    ):
+        path = meta_path(name) / ROLLUP_FILE.format(year=year, month=month)
+        if path.exists() and (rebuilt is None or path in rebuilt):
+            rows = pl.concat([pl.read_parquet(path), rows])
+        if rebuilt is not None:
+            rebuilt.add(path)
+        _write_parquet_atomic(merge_aggregates(rows), path)
+
+
+def _month_of(path: Path) -> tuple[int, int]:
+    """The year and month of a rollup file, from its name"""
+    year, month = path.stem.split("-")
+    return int(year), int(month)
+
+
+def _partition_of(path: Path) -> tuple[int, int]:
+    """The year and month of a data file, from the names of its directories"""
+    return int(path.parent.parent.name[5:]), int(path.parent.name[6:])
+
+
+def _hot_rows() -> DataFrame:
+    """The rows that belong in the hot copy, read from the archive"""
+    if (days := hot_days()) is None:
+        return read()
+    if (last := latest()) is None:
+        return pl.DataFrame(schema=STORED_SCHEMA)
+    with reading():
+        return scan(last - timedelta(days=days)).collect()
+
+
+def _hot_segments(current: int) -> list[Path] | None:
+    """The files of the hot copy of a version, from the export it starts with to the
+    rows written in that version, or None if there's no complete copy of it"""
+    for export in meta_path("hot").glob("v*"):
+        first = int(export.name[1:]) if export.is_dir() else current + 1
+        # The version of a legacy single file is its modification time
+        if first > current or (first < current and not is_partitioned()):
+            continue
+
+        segments = []
+        for number in range(first, current + 1):
+            if not (path := export / f"v{number}.arrow").exists():
+                break
+            segments.append(path)
+        else:
+            return segments
+    return None
+
+
+def _write_hot(path: Path, rows: Callable[[], DataFrame]) -> None:
+    """Write a file of the hot copy, unless another process just did. An export starts
+    a new copy in a directory of its own, and the older copies are removed"""
+    meta_path("hot").mkdir(parents=True, exist_ok=True)
+    with _locked(meta_path("hot") / ".lock"):
+        if path.exists():
+            return
+
+        path.parent.mkdir(exist_ok=True)
+        tmp = _tmp_path(path)
+        rows().write_ipc(tmp, compression="uncompressed")
+        os.replace(tmp, path)
+
+        # Processes that still map an older copy keep it until they let go of it
+        if path.stem == path.parent.name:
+            for old in meta_path("hot").glob("v*"):
+                if old == path.parent:
+                    continue
+                if old.is_dir():
+                    shutil.rmtree(old, ignore_errors=True)
+                else:
+                    old.unlink(missing_ok=True)
+
+
+def _tmp_path(path: Path) -> Path:
+    """A hidden file next to a path to write it to first, which is unique to the writer
+    so that no two threads or processes ever write to the same one"""
+    return path.with_name(f".{path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _part_name() -> str:
+    return f"part-{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+
+
+def _write_parquet_atomic(df: DataFrame, path: Path) -> None:
+    """Write to a temporary file first, so a killed process never leaves half a file"""
+    tmp = _tmp_path(path)
+    try:
+        df.write_parquet(tmp, statistics=True, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+@contextmanager
+def _locked(path: Path, shared: bool = False) -> Iterator[None]:
+    """Hold an exclusive lock on a file, or one of many shared locks, across
+    processes"""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    tmp = _tmp_path(path)
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
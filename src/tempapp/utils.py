@@ -1,14 +1,21 @@
 import json
 import os
+import threading
+from collections.abc import Sequence
 from datetime import datetime
-from typing import Tuple
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Tuple
 from zoneinfo import ZoneInfo
 
 import polars as pl
-from coloraide import Color
-from coloraide.interpolate import Interpolator
 from polars import DataFrame
 
+from . import metrics, storage
+
+if TYPE_CHECKING:
+    from coloraide.interpolate import Interpolator
+
 
 def load_settings() -> dict:
     settings_path = os.environ.get("APP_SETTINGS", "./settings.json")
@@ -33,7 +40,17 @@ palette = [
     "#A50026",
 ]
 
-interpolator = Color.interpolate(palette, space="srgb")
+
+@cache
+def palette_interpolator() -> "Interpolator":
+    """Colors along the palette, made on first use as coloraide is slow to import"""
+    from coloraide import Color
+
+    return Color.interpolate(palette, space="srgb")
+
+
+# The temperatures that the palette is spread out between
+COLOR_MIN, COLOR_MAX = 18, 25
 
 
 def dot_to_comma(num: float) -> str:
@@ -41,9 +58,123 @@ def dot_to_comma(num: float) -> str:
     return str(num).replace(".", ",")
 
 
+# Data shared by every session in the process, together with the dataset version
+# it was loaded at
+_data_cache: dict[str, tuple[int, DataFrame]] = {}
+_data_lock = threading.RLock()
+
+# Worker processes started by `tempapp run --workers N` share one memory-mapped copy
+# of the dataset, rather than reading it into each process
+WORKERS = int(os.environ.get("TEMPAPP_WORKERS", "1"))
+
+# The files that each cached copy of data read from the archive was read from, each
+# with what identifies that version of the file, so one replaced under the same name
+# is not taken for the file that was read
+_data_files: dict[str, dict[Path, tuple[int, int, int]]] = {}
+
+
+def _shared(name: str, load: Callable[[DataFrame | None], DataFrame]) -> DataFrame:
+    """Load data once per version of the dataset and hand the same frame to everyone.
+    The loader gets what was loaded for the previous version, if anything"""
+    version = storage.version()
+    with _data_lock:
+        if name not in _data_cache or _data_cache[name][0] != version:
+            previous = _data_cache[name][1] if name in _data_cache else None
+            with metrics.timer(metrics.load_seconds, source=name):
+                _data_cache[name] = (version, load(previous))
+        return _data_cache[name][1]
+
+
+def _file_ids(paths: list[Path]) -> dict[Path, tuple[int, int, int]]:
+    """The inode, modification time and size of each file"""
+    ids = {}
+    for path in paths:
+        stat = path.stat()
+        ids[path] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return ids
+
+
+def _new_files(
+    name: str, files: dict[Path, tuple[int, int, int]], previous: DataFrame | None
+) -> list[Path] | None:
+    """The files added since the previous read of a cached copy, or None if it has to
+    be read in full, as there is none or some of the files it was read from have been
+    removed or replaced"""
+    read_before = _data_files.get(name, {})
+    if (
+        previous is None
+        or any(files.get(path) != file for path, file in read_before.items())
+        or not storage.is_partitioned()
+    ):
+        return None
+    return [path for path in files if path not in read_before]
+
+
+def _read_all(previous: DataFrame | None) -> DataFrame:
+    """Read the whole dataset, or only the files added since the previous read"""
+    with storage.reading():
+        paths = storage.files()
+        files = _file_ids(paths)
+        new_paths = _new_files("all", files, previous)
+        if new_paths is None:
+            data = storage.read(paths)
+        elif new_paths:
+            data = pl.concat([previous, storage.read(new_paths)], rechunk=False)
+        else:
+            data = previous
+
+    _data_files["all"] = files
+    return data
+
+
+def _read_recent(previous: DataFrame | None) -> DataFrame:
+    """Scan the last day of data from the archive, or add the files added since the
+    previous read to what was read then"""
+    with storage.reading():
+        paths = storage.files()
+        files = _file_ids(paths)
+        new_paths = _new_files("recent", files, previous)
+        if new_paths is None:
+            data = storage.recent()
+        else:
+            data = storage.recent(
+                df=pl.concat([storage.compact(previous), storage.read(new_paths)])
+            )
+
+    _data_files["recent"] = files
+    return data
+
+
+def _map_hot(previous: DataFrame | None) -> DataFrame:
+    """The hot copy of the dataset, backed by pages shared through the page cache"""
+    return pl.concat(
+        [
+            pl.read_ipc(path, memory_map=True, rechunk=False)
+            for path in storage.hot_copy()
+        ],
+        rechunk=False,
+    )
+
+
+def _use_hot() -> bool:
+    """Whether to read the memory-mapped hot copy rather than the Parquet archive,
+    which several workers always do so they don't each hold a copy of the data"""
+    return WORKERS > 1 or storage.backend() == "arrow"
+
+
 def load_data() -> DataFrame:
-    """Loads data for use in the app"""
-    return pl.read_parquet(SETTINGS["data"])
+    """Loads all data, from the hot copy if it holds all of it. Otherwise only reading
+    what has been added to the archive since the last time"""
+    if _use_hot() and storage.hot_days() is None:
+        return _shared("hot", _map_hot)
+    return _shared("all", _read_all)
+
+
+def load_recent() -> DataFrame:
+    """Loads the last day of data, which is all the dashboard needs of the raw rows"""
+    if _use_hot():
+        return _shared("recent", lambda _: storage.recent(df=_shared("hot", _map_hot)))
+    return _shared("recent", _read_recent)
 
 
 def split_floor_data(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
@@ -66,9 +197,10 @@ def color_difference(color1, color2) -> int:
 
 
 def determine_colors(
-    temp: int, interpolator: Interpolator = interpolator
+    temp: int, interpolator: "Interpolator | None" = None
 ) -> Tuple[str, str]:
     """Sets the background and foreground color according to temperature"""
+    interpolator = interpolator or palette_interpolator()
     tmin, tmax = (
         18 if temp > 18 else temp,
         # Set the minimum value for the color scale
@@ -113,6 +245,34 @@ def determine_colors(
     return bg_color, best_fg_color
 
 
+@cache
+def color_table() -> DataFrame:
+    """Background and foreground colors for every 0.1 °C from COLOR_MIN to COLOR_MAX,
+    anything colder or warmer gets the colors of the ends of the scale"""
+    temps = [
+        round(COLOR_MIN + i / 10, 1) for i in range((COLOR_MAX - COLOR_MIN) * 10 + 1)
+    ]
+    bg_colors, fg_colors = zip(*(determine_colors(temp) for temp in temps))
+    return pl.DataFrame({"temp": temps, "bg": bg_colors, "fg": fg_colors})
+
+
+def colors_for(temps: pl.Series | Sequence[float]) -> DataFrame:
+    """Background and foreground colors for a whole column of temps (a Polars Series,
+    NumPy array or list) at once, looked up in the color table"""
+    table = color_table()
+    index = (
+        (
+            (pl.Series(temps, dtype=pl.Float64).clip(COLOR_MIN, COLOR_MAX) - COLOR_MIN)
+            * 10
+        )
+        .round()
+        .cast(pl.UInt32)
+    )
+    return pl.DataFrame(
+        {"bg": table["bg"].gather(index), "fg": table["fg"].gather(index)}
+    )
+
+
 def fix_timezone(dt: datetime) -> datetime:
     """A helper function to set the correct timezone on Shiny input filter"""
     return dt.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo("Europe/Stockholm"))
@@ -0,0 +1,73 @@
+// Draws the charts in the browser when the app runs with "render_mode": "client".
+// The server sends the options of each chart once, and after that only its data,
+// see the payload functions in charts.py
+$(function () {
+  const charts = {};
+
+  // Temps come in tenths of a degree, each as the difference to the one before it
+  function decode(deltas) {
+    let tenths = 0;
+    return deltas.map(function (delta) {
+      if (delta === null) return null;
+      tenths += delta;
+      return tenths / 10;
+    });
+  }
+
+  function dataOptions(data) {
+    if (data.kind === "heatmap") {
+      // The cells are in order of day and then hour
+      const cells = decode(data.temps).map(function (temp, i) {
+        return [Math.floor(i / data.y.length), i % data.y.length, temp];
+      });
+      return {
+        xAxis: [{ data: data.x }],
+        yAxis: [{ data: data.y }],
+        visualMap: { min: data.min, max: data.max },
+        series: [{ data: cells }],
+      };
+    }
+
+    return {
+      xAxis: [{ data: data.x }],
+      yAxis: [{ min: data.min, max: data.max }],
+      series: data.series.map(function (temps) {
+        const series = { data: decode(temps) };
+        // Dense lines are drawn without a circle for each point
+        if ("symbols" in data) series.showSymbol = data.symbols;
+        return series;
+      }),
+    };
+  }
+
+  Shiny.addCustomMessageHandler("tempapp-chart", function (message) {
+    const element = document.getElementById(message.id);
+    if (!element) return;
+
+    if (message.options) {
+      if (charts[message.id]) charts[message.id].dispose();
+      charts[message.id] = echarts.init(element, null, { renderer: "svg" });
+      charts[message.id].setOption(message.options);
+    }
+    if (charts[message.id]) charts[message.id].setOption(dataOptions(message.data));
+  });
+
+  // The server picks how many points to send by the width of each chart, which
+  // is 0 while its tab isn't shown
+  function reportWidths() {
+    $(".tempapp-chart").each(function () {
+      if (this.clientWidth) Shiny.setInputValue(this.id + "_width", this.clientWidth);
+    });
+  }
+  $(document).on("shiny:connected", reportWidths);
+
+  // Charts on a tab that wasn't shown when they were drawn have no size yet
+  function resize() {
+    Object.values(charts).forEach(function (chart) {
+      chart.resize();
+    });
+    reportWidths();
+  }
+  $(window).on("resize", resize);
+  $(document).on("shown.bs.tab", resize);
+});
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import threading
+from collections.abc import Callable, Iterator
+from datetime import UTC, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+
+# The settings are read when tempapp is imported, so they have to be in place first.
+# Each test gets a dataset and an API stub of its own through the fixtures below
+_settings = Path(tempfile.mkdtemp(prefix="tempapp-tests-")) / "settings.json"
+_settings.write_text(
+    json.dumps({"data": "", "server": "", "headers": {"Authorization": "Bearer x"}})
+)
+os.environ["APP_SETTINGS"] = str(_settings)
+
+from tempapp import utils
+
+# The friendly name of each sensor, which is what its floor is stored as
+FLOORS = {
+    "sensor.temperature_10": "Våning 1",
+    "sensor.temperature_13": "Våning 2",
+    "sensor.temperature_16": "Våning 3",
+}
+
+
+def readings(start: datetime, end: datetime, entities: list[str]) -> list[list[dict]]:
+    """A history response like Home Assistant's with minimal_response: each entity
+    starts with its state at the start, with its attributes, followed by a reading
+    every 10 minutes of which every fifth is unavailable"""
+    history = []
+    for i, entity in enumerate(entities):
+        states = [
+            {
+                "entity_id": entity,
+                "state": "20.0",
+                "attributes": {
+                    "friendly_name": FLOORS[entity],
+                    "unit_of_measurement": "°C",
+                },
+                "last_changed": start.astimezone(UTC).isoformat(),
+            }
+        ]
+        time = start.replace(minute=0, second=0, microsecond=0)
+        time += timedelta(minutes=3 + i)
+        while time < end:
+            if time > start:
+                minutes = int(time.timestamp() // 60)
+                state = "unavailable" if minutes % 50 < 10 else f"{20 + minutes % 7}.04"
+                states.append(
+                    {
+                        "state": state,
+                        "last_changed": time.astimezone(UTC).isoformat(),
+                    }
+                )
+            time += timedelta(minutes=10)
+        history.append(states)
+    return history
+
+
+class Stub(ThreadingHTTPServer):
+    """The history API of Home Assistant. Responses are sent chunked, in pieces of
+    chunk_size bytes, with the last cut bytes of the body left out"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.history: Callable[[datetime, datetime, list[str]], list] = readings
+        self.chunk_size = 997
+        self.cut = 0
+        self.requests: list[tuple[datetime, datetime, list[str]]] = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Stub
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        start = datetime.fromisoformat(unquote(url.path.rsplit("/", 1)[1]))
+        end = datetime.fromisoformat(query["end_time"][0])
+        entities = query["filter_entity_id"][0].split(",")
+        self.server.requests.append((start, end, entities))
+
+        body = json.dumps(self.server.history(start, end, entities)).encode()
+        body = body[: len(body) - self.server.cut]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(body), self.server.chunk_size):
+            chunk = body[i : i + self.server.chunk_size]
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dataset(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """An empty partitioned dataset"""
+    path = tmp_path / "data"
+    monkeypatch.setitem(utils.SETTINGS, "data", str(path))
+    return path
+
+
+@pytest.fixture
+def api(dataset: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Stub]:
+    """A stub of the API that the settings point to"""
+    stub = Stub()
+    thread = threading.Thread(target=stub.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(utils.SETTINGS, "scheme", "http")
+    monkeypatch.setitem(utils.SETTINGS, "server", f"127.0.0.1:{stub.server_port}")
+    monkeypatch.setitem(utils.SETTINGS, "sensors", [e[7:] for e in FLOORS])
+    yield stub
+    stub.shutdown()
+    stub.server_close()
@@ -0,0 +1,137 @@
+import json
+from datetime import datetime, timedelta
+from itertools import pairwise
+from zoneinfo import ZoneInfo
+
+import polars as pl
+import pytest
+from conftest import FLOORS, Stub, readings
+
+from tempapp import pipeline, storage
+
+TZ = ZoneInfo("Europe/Stockholm")
+START = datetime(2025, 1, 10, 12, 30, tzinfo=TZ)
+
+
+def chunked(body: bytes, size: int) -> list[bytes]:
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 2**16])
+def test_history_states_across_chunk_splits(size):
+    history = readings(START, START + timedelta(hours=2), list(FLOORS))
+    body = json.dumps(history, ensure_ascii=False).encode()
+
+    states = list(pipeline.history_states(chunked(body, size)))
+
+    assert states == [
+        (entity, state) for entity, states in enumerate(history) for state in states
+    ]
+
+
+def test_history_states_of_empty_entity_lists():
+    body = b'[[], [{"state": "21.5", "last_changed": "x"}], []]'
+
+    assert list(pipeline.history_states(chunked(body, 5))) == [
+        (1, {"state": "21.5", "last_changed": "x"})
+    ]
+    assert list(pipeline.history_states([b"[]"])) == []
+    assert list(pipeline.history_states([b"[[]", b", []]"])) == []
+
+
+@pytest.mark.parametrize("cut", [1, 2, 10, 100])
+def test_history_states_of_a_truncated_body(cut):
+    history = readings(START, START + timedelta(hours=2), list(FLOORS))
+    body = json.dumps(history).encode()
+
+    with pytest.raises(ValueError):
+        list(pipeline.history_states(chunked(body[:-cut], 13)))
+
+
+def test_fetch_history_skips_unavailable_states(api: Stub):
+    end = START + timedelta(hours=6)
+    api.chunk_size = 5
+
+    df = pipeline.fetch_history(START, end)
+
+    expected = [
+        state
+        for states in readings(START, end, list(FLOORS))
+        for state in states[1:]
+        if state["state"] != "unavailable"
+    ]
+    assert df.height == len(expected) > 0
+    assert sorted(df["floor"].unique()) == sorted(FLOORS.values())
+    # The state at the start is a repeat of a reading from before
+    assert df["time"].min() > START
+    assert df["time"].max() < end
+
+
+def test_fetch_history_of_an_entity_without_states(api: Stub):
+    def history(start, end, entities):
+        states = readings(start, end, entities)
+        return [[], states[1], []]
+
+    api.history = history
+    df = pipeline.fetch_history(START, START + timedelta(hours=2))
+
+    assert df["floor"].unique().to_list() == ["Våning 2"]
+
+
+def test_fetch_history_of_a_truncated_body(api: Stub):
+    api.cut = 3
+
+    with pytest.raises(ValueError):
+        pipeline.fetch_history(START, START + timedelta(hours=2))
+
+
+def test_backfill_asks_for_each_page(api: Stub):
+    end = START + timedelta(days=1)
+
+    pipeline.backfill(START, end, page=timedelta(hours=5))
+
+    pages = [(start, page_end) for start, page_end, _ in api.requests]
+    assert pages[0][0] == START
+    assert pages[-1][1] == end
+    assert all(a[1] == b[0] for a, b in pairwise(pages))
+    assert all(page_end - start <= timedelta(hours=5) for start, page_end in pages)
+    assert all(entities == list(FLOORS) for _, _, entities in api.requests)
+
+    stored = storage.read()
+    assert stored.select("time", "floor").is_duplicated().sum() == 0
+    assert stored.height == pipeline.fetch_history(START, end).height
+
+
+def test_backfill_again_writes_nothing_new(api: Stub):
+    end = START + timedelta(days=1)
+    pipeline.backfill(START, end, page=timedelta(hours=7), batch_size=50)
+    stored = storage.read().sort("time", "floor")
+    version = storage.version()
+
+    # Again with other pages, and over a longer range that overlaps the first
+    pipeline.backfill(START, end, page=timedelta(hours=3))
+    assert storage.version() == version
+    assert storage.read().sort("time", "floor").equals(stored)
+
+    pipeline.backfill(START - timedelta(hours=6), end + timedelta(hours=6))
+    again = storage.read().sort("time", "floor")
+    assert again.select("time", "floor").is_duplicated().sum() == 0
+    assert again.join(stored, on=["time", "floor"], how="anti").height > 0
+    assert stored.join(again, on=["time", "floor"], how="anti").is_empty()
+
+
+def test_backfill_stops_at_a_truncated_page(api: Stub):
+    end = START + timedelta(days=1)
+    pipeline.backfill(START, START + timedelta(hours=12))
+    stored = storage.read()
+
+    api.cut = 1
+    with pytest.raises(ValueError):
+        pipeline.backfill(START, end, page=timedelta(hours=6), batch_size=1)
+
+    # Nothing of the truncated page was written, and a rerun fills in the rest
+    assert storage.read().equals(stored)
+    api.cut = 0
+    pipeline.backfill(START, end, page=timedelta(hours=6))
+    assert storage.read().height == pipeline.fetch_history(START, end).height
+    assert storage.read().filter(pl.col("time") <= START).is_empty()